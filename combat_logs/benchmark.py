@@ -0,0 +1,213 @@
+#!/usr/bin/python
+# Copyright 2010 Matt Rudary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Benchmark the log parser on synthetic gamelogs.
+
+For each combat format, a log is generated with log_generator and run
+through three stages: log_parser.Log.parse_log, which reads the file,
+probes its format and parses every line;
+combat_log_analyzer.extract_streams; and serializing the streams as
+JSON. Each run happens in a fresh process so that its peak RSS is its
+own, and the fastest of several runs is reported.
+
+Results can be saved as a baseline, and later runs compared to it:
+
+  python benchmark.py --save-baseline baseline.json
+  python benchmark.py --baseline baseline.json
+
+The comparison exits with status 1 if any stage got slower, or the peak
+RSS grew, by more than the tolerance.
+
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import combat_log_analyzer
+import log_generator
+import log_parser
+
+
+STAGES = ('parse_log', 'extract_streams', 'serialize')
+
+
+def _peak_rss_kb():
+    """The peak resident set size of this process, in kilobytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Reported in bytes rather than kilobytes.
+        rss //= 1024
+    return rss
+
+
+def _run_once(filename):
+    """Run each stage on filename. Runs in a worker process.
+
+    Returns:
+      A dict with the number of 'lines', the seconds each of STAGES
+      took, and the 'peak_rss_kb' of the process.
+
+    """
+    with open(filename, 'r') as infile:
+        start = time.time()
+        log = log_parser.Log.parse_log(infile)
+        parse_time = time.time() - start
+    num_lines = sum(1 for line in open(filename, 'r'))
+
+    start = time.time()
+    streams = combat_log_analyzer.extract_streams(log)
+    extract_time = time.time() - start
+
+    start = time.time()
+    json.dumps(streams, default=combat_log_analyzer.serialize)
+    serialize_time = time.time() - start
+
+    return {
+        'lines': num_lines,
+        'entries': log.num_entries,
+        'parse_log': parse_time,
+        'extract_streams': extract_time,
+        'serialize': serialize_time,
+        'peak_rss_kb': _peak_rss_kb(),
+        }
+
+
+def benchmark_file(filename, repeat=3):
+    """Benchmark filename, returning the best of repeat runs.
+
+    Each stage's time and the peak RSS are minimized separately.
+
+    """
+    best = None
+    for i in xrange(repeat):
+        pool = multiprocessing.Pool(1)
+        try:
+            result = pool.apply(_run_once, (filename,))
+        finally:
+            pool.close()
+            pool.join()
+        if best is None:
+            best = result
+        else:
+            for key in STAGES + ('peak_rss_kb',):
+                best[key] = min(best[key], result[key])
+    best['lines_per_second'] = best['lines'] / max(best['parse_log'], 1e-9)
+    return best
+
+
+def benchmark(num_lines, formats=log_generator.FORMATS, repeat=3, seed=0):
+    """Benchmark a generated log of num_lines lines in each format.
+
+    Returns:
+      A dict mapping each format to the result of benchmark_file.
+
+    """
+    tempdir = tempfile.mkdtemp(prefix='evelib_benchmark')
+    try:
+        results = {}
+        for log_format in formats:
+            filename = os.path.join(tempdir, '%s.txt' % log_format)
+            with open(filename, 'wb') as outfile:
+                log_generator.write_log(outfile, num_lines, [log_format], seed)
+            results[log_format] = benchmark_file(filename, repeat)
+        return results
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Compare results to a baseline from an earlier benchmark.
+
+    Returns:
+      A list of strings, each describing a stage or peak RSS that is
+      more than tolerance worse than the baseline.
+
+    """
+    regressions = []
+    for log_format, result in sorted(results.iteritems()):
+        base = baseline.get(log_format)
+        if base is None or base['lines'] != result['lines']:
+            continue
+        for key in STAGES + ('peak_rss_kb',):
+            # Baselines may predate a stage, or its current name.
+            if key in base and result[key] > base[key] * (1 + tolerance):
+                regressions.append(
+                    '%s %s: %.4g, was %.4g (%+.0f%%)'
+                    % (log_format, key, result[key], base[key],
+                       100.0 * (float(result[key]) / base[key] - 1)))
+    return regressions
+
+
+def report(results, out=sys.stdout):
+    for log_format, result in sorted(results.iteritems()):
+        print >>out, (
+            '%-10s %8d lines %10.0f lines/s  parse_log %.3fs  '
+            'extract_streams %.3fs  serialize %.3fs  peak RSS %d KB'
+            % (log_format, result['lines'], result['lines_per_second'],
+               result['parse_log'], result['extract_streams'],
+               result['serialize'], result['peak_rss_kb']))
+
+
+def read_flags(argv):
+    parser = argparse.ArgumentParser(
+        prog=argv[0],
+        description='Benchmark the log parser on synthetic gamelogs.')
+    parser.add_argument('-n', '--lines', type=int, default=100000,
+                        help='The number of lines in each generated log.')
+    parser.add_argument('-f', '--format', dest='formats', action='append',
+                        choices=log_generator.FORMATS,
+                        help='A combat format to benchmark. Repeat for '
+                        'several. Defaults to all of them.')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='The number of runs to take the best of.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The random seed for generating logs.')
+    parser.add_argument('--save-baseline', metavar='<file>',
+                        help='Save the results as a baseline.')
+    parser.add_argument('--baseline', metavar='<file>',
+                        help='Compare the results to a saved baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='The fraction by which a result may be worse '
+                        'than the baseline.')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    flags = read_flags(argv)
+    results = benchmark(flags.lines, flags.formats or log_generator.FORMATS,
+                        flags.repeat, flags.seed)
+    report(results)
+    if flags.save_baseline:
+        with open(flags.save_baseline, 'w') as outfile:
+            json.dump(results, outfile, indent=2, sort_keys=True)
+    if flags.baseline:
+        with open(flags.baseline, 'r') as infile:
+            baseline = json.load(infile)
+        regressions = compare(results, baseline, flags.tolerance)
+        for regression in regressions:
+            print >>sys.stderr, 'Regression: %s' % regression
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
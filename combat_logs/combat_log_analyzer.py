@@ -14,10 +14,14 @@
 
 """Library to analyze Eve combat logs."""
 
+import bisect
+import collections
 import datetime
+import itertools
 import re
 import time
 
+import instrumentation
 import log_parser
 
 
@@ -35,18 +39,69 @@ class DamageStream(object):
         """
         self._attacker = attacker
         self._target = target
-        self._damage = list(damage)
+        self._times = []
+        self._amounts = []
+        for t, amount in damage:
+            self._times.append(t)
+            self._amounts.append(amount)
         self._ticker = ticker
         self._weapon = weapon or 'Unknown'
         self._enemy_ships = ', '.join(enemy_ships) or 'Unknown'
-        self._total_damage = sum(d[1] for d in self._damage)
-        if self._damage:
-            self._start_time = self._damage[0][0]
-            self._end_time = self._damage[-1][0]
+        self._build_index()
+
+    def _build_index(self):
+        # The running totals of the damage, so that _cumulative[j] -
+        # _cumulative[i] is the damage at _times[i:j]. Window queries
+        # bisect _times.
+        self._cumulative = [0]
+        for amount in self._amounts:
+            self._cumulative.append(self._cumulative[-1] + amount)
+        if self._times:
+            self._start_time = self._times[0]
+            self._end_time = self._times[-1]
         else:
             self._start_time = None
             self._end_time = None
 
+    def __getstate__(self):
+        """Pickle only the damage and the stream's description.
+
+        The running totals are rebuilt when the stream is unpickled.
+
+        """
+        return (self._attacker, self._target, self._times, self._amounts,
+                self._ticker, self._weapon, self._enemy_ships)
+
+    def __setstate__(self, state):
+        (self._attacker, self._target, self._times, self._amounts,
+         self._ticker, self._weapon, self._enemy_ships) = state
+        self._build_index()
+
+    def add_damage(self, timestamp, amount):
+        """Add amount of damage at timestamp to the end of this stream.
+
+        If timestamp is the same as the latest timestamp, amount is
+        merged into it.
+
+        """
+        times = self._times
+        amounts = self._amounts
+        cumulative = self._cumulative
+        if times and times[-1] == timestamp:
+            amounts[-1] += amount
+            cumulative[-1] = cumulative[-2] + amounts[-1]
+        else:
+            if not times:
+                self._start_time = timestamp
+            times.append(timestamp)
+            amounts.append(amount)
+            cumulative.append(cumulative[-1] + amount)
+            self._end_time = timestamp
+
+    def _set_enemy_info(self, ticker, enemy_ships):
+        self._ticker = ticker
+        self._enemy_ships = ', '.join(enemy_ships) or 'Unknown'
+
     @property
     def attacker(self):
         """The character and/or ship dealing this damage."""
@@ -70,11 +125,11 @@ class DamageStream(object):
     @property
     def damage(self):
         """An iterator generating a sequence of (timestamp. amount) pairs."""
-        return iter(self._damage)
+        return itertools.izip(self._times, self._amounts)
 
     @property
     def total_damage(self):
-        return self._total_damage
+        return self._cumulative[-1]
 
     @property
     def enemy_ships(self):
@@ -91,6 +146,43 @@ class DamageStream(object):
         """The latest timestamp in this damage stream, or None."""
         return self._end_time
 
+    def _window_indexes(self, start, end):
+        """The slice of _times with start <= timestamp < end."""
+        return (bisect.bisect_left(self._times, start),
+                bisect.bisect_left(self._times, end))
+
+    def damage_between(self, start, end):
+        """The damage at timestamps t with start <= t < end.
+
+        start and end are datetime.datetimes comparable to the stream's
+        timestamps. This takes O(log n) time.
+
+        """
+        i, j = self._window_indexes(start, end)
+        return self._cumulative[max(i, j)] - self._cumulative[i]
+
+    def dps_between(self, start, end):
+        """The damage per second from start (inclusive) to end (exclusive)."""
+        d = end - start
+        seconds = d.days * 86400 + d.seconds + d.microseconds / 1e6
+        if seconds <= 0:
+            return 0.0
+        return self.damage_between(start, end) / seconds
+
+    def is_active(self, start, end):
+        """Whether there is damage at any t with start <= t < end."""
+        i, j = self._window_indexes(start, end)
+        return i < j
+
+    def window(self, start, end):
+        """Return a new DamageStream with the damage in [start, end)."""
+        i, j = self._window_indexes(start, end)
+        stream = DamageStream(self.attacker, self.target,
+                              zip(self._times[i:j], self._amounts[i:j]),
+                              self.ticker, self.weapon)
+        stream._enemy_ships = self._enemy_ships
+        return stream
+
     def to_json_serializable(self):
         """Convert this DamageStream to an object json.dump can serialize."""
         return {
@@ -105,8 +197,34 @@ class DamageStream(object):
             'total_damage': self.total_damage,
             }
 
+    def to_compact_json_serializable(self):
+        """Like to_json_serializable, but with the damage delta-encoded.
+
+        Instead of 'damage', the object has 'base_time', the first
+        timestamp; 'offsets', the number of seconds since the previous
+        timestamp (0 for the first); and 'amounts', the damage at each
+        timestamp.
+
+        """
+        obj = self.to_json_serializable()
+        damage = obj.pop('damage')
+        offsets = []
+        previous = None
+        for t, amount in damage:
+            if previous is None:
+                offsets.append(0)
+            else:
+                d = t - previous
+                offsets.append(d.days * 86400 + d.seconds)
+            previous = t
+        obj['base_time'] = self.start_time
+        obj['offsets'] = offsets
+        obj['amounts'] = [amount for t, amount in damage]
+        return obj
+
 
 def combat_entries(log):
+    """Generate the CombatLogEntry objects in log, which may be lazy."""
     for e in log.log_entries:
         if e.entry_type == log_parser.LogEntry.COMBAT:
             yield e
@@ -155,35 +273,197 @@ def enemy_info(id_string):
         return (name, ship, '%s (%s)' % (corp, alliance))
 
 
-def extract_streams(log):
-    """Extract damage streams from the given log_parser.Log."""
-    # key = (weapon, enemy_name), value = [(timestamp, damage_amount),...]
-    your_damage_streams = {}
-    enemy_damage_streams = {}
-    # key = name, value = (ticker, set([ship1, ship2,...]))
-    enemy_info_map = {}
-    for e in combat_entries(log):
-        if e.attacker.strip().lower() == 'you':
-            enemy = e.target
-            enemy_name, ship, ticker = enemy_info(enemy)
-            stream = your_damage_streams.setdefault((e.weapon, enemy_name), [])
-        else:
-            enemy = e.attacker
-            enemy_name, ship, ticker = enemy_info(enemy)
-            stream = enemy_damage_streams.setdefault((e.weapon, enemy_name), [])
-
-        timestamp = e.timestamp
-        amount = e.damage
-        if stream and stream[-1][0] == timestamp:
-            stream[-1] = (timestamp, stream[-1][1] + amount)
-        else:
-            stream.append((timestamp, amount))
+class EntityRegistry(object):
+    """Resolves each distinct enemy id string with enemy_info only once.
 
-        if ship is not None:
-            t, ship_types = enemy_info_map.setdefault(enemy_name,
-                                                      (ticker, set()))
-            ship_types.add(ship)
+    A fight has only a few dozen distinct id strings, so a registry may
+    be shared by all the logs of a batch run. It remembers at most
+    max_size id strings, forgetting the least recently used first.
+
+    """
+    def __init__(self, max_size=10000):
+        self._max_size = max_size
+        # key = id_string, value = (name, ship, corp_and_alliance)
+        self._entities = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def resolve(self, id_string):
+        """Return enemy_info(id_string), computing it at most once."""
+        try:
+            # Move it to the end, so the least recently used is first.
+            info = self._entities.pop(id_string)
+            self._hits += 1
+        except KeyError:
+            self._misses += 1
+            info = enemy_info(id_string)
+            if len(self._entities) >= self._max_size:
+                self._entities.popitem(last=False)
+        self._entities[id_string] = info
+        return info
+
+    def __len__(self):
+        return len(self._entities)
+
+    @property
+    def hits(self):
+        """The number of calls to resolve answered from the registry."""
+        return self._hits
+
+    @property
+    def misses(self):
+        """The number of calls to resolve that ran enemy_info."""
+        return self._misses
+
+    @property
+    def hit_rate(self):
+        """The fraction of calls to resolve that were hits, or None."""
+        lookups = self._hits + self._misses
+        if not lookups:
+            return None
+        return float(self._hits) / lookups
 
+
+def extract_streams(log, registry=None):
+    """Extract damage streams from the given log_parser.Log.
+
+    The log's entries are read exactly once, so log may be lazy. If
+    registry, an EntityRegistry, is given, it is used to resolve enemy
+    id strings.
+
+    """
+    with instrumentation.timed('extract_streams'):
+        builder = DamageStreamBuilder(registry)
+        builder.add_entries(combat_entries(log))
+        return builder.streams
+
+
+class DamageStreamBuilder(object):
+    """Builds the DamageStreams of a log incrementally.
+
+    Adding combat entries only touches the streams they belong to, so
+    the cost of each call to add_entries is proportional to the number
+    of entries added. Enemies are numbered in order of appearance, and
+    enemy id strings are resolved through an EntityRegistry.
+
+    """
+    def __init__(self, registry=None):
+        if registry is None:
+            registry = EntityRegistry()
+        self._registry = registry
+        # key = enemy_name, value = enemy_id
+        self._enemy_ids = {}
+        # key = (weapon, enemy_id), value = DamageStream
+        self._your_damage_streams = {}
+        self._enemy_damage_streams = {}
+        # index = enemy_id, value = (ticker, set([ship1, ship2,...])) or None
+        self._enemy_info = []
+        # index = enemy_id, value = [DamageStream, ...]
+        self._streams_by_enemy = []
+
+    @property
+    def streams(self):
+        """A list of all DamageStreams built so far.
+
+        The DamageStreams are updated in place by later calls to
+        add_entries.
+
+        """
+        return (self._your_damage_streams.values()
+                + self._enemy_damage_streams.values())
+
+    def add_entries(self, entries):
+        """Add an iterable of CombatLogEntry objects to the streams.
+
+        The entries must follow any previously added entries in
+        timestamp order.
+
+        Returns:
+          A list of the DamageStreams that were created or changed.
+
+        """
+        resolve = self._registry.resolve
+        enemy_ids = self._enemy_ids
+        enemy_info = self._enemy_info
+        changed = set()
+        changed_enemies = set()
+        for e in entries:
+            if e.attacker.strip().lower() == 'you':
+                enemy_attacks = False
+                enemy = e.target
+                stream_map = self._your_damage_streams
+            else:
+                enemy_attacks = True
+                enemy = e.attacker
+                stream_map = self._enemy_damage_streams
+            enemy_name, ship, ticker = resolve(enemy)
+            enemy_id = enemy_ids.get(enemy_name)
+            if enemy_id is None:
+                enemy_id = enemy_ids[enemy_name] = len(enemy_info)
+                enemy_info.append(None)
+                self._streams_by_enemy.append([])
+
+            key = (e.weapon, enemy_id)
+            stream = stream_map.get(key)
+            if stream is None:
+                if enemy_attacks:
+                    stream = DamageStream(enemy_name, 'You', [],
+                                          weapon=e.weapon)
+                else:
+                    stream = DamageStream('You', enemy_name, [],
+                                          weapon=e.weapon)
+                stream_map[key] = stream
+                self._streams_by_enemy[enemy_id].append(stream)
+                changed_enemies.add(enemy_id)
+            stream.add_damage(e.timestamp, e.damage)
+            changed.add(stream)
+
+            if ship is not None:
+                if enemy_info[enemy_id] is None:
+                    enemy_info[enemy_id] = (ticker, set())
+                ship_types = enemy_info[enemy_id][1]
+                if ship not in ship_types:
+                    ship_types.add(ship)
+                    changed_enemies.add(enemy_id)
+
+        for enemy_id in changed_enemies:
+            ticker, ships = enemy_info[enemy_id] or ('Unknown', [])
+            for stream in self._streams_by_enemy[enemy_id]:
+                stream._set_enemy_info(ticker, ships)
+                changed.add(stream)
+
+        return list(changed)
+
+
+def follow_streams(filename, interval=1.0):
+    """Follow a growing log file, generating its damage streams live.
+
+    Every interval seconds, the complete lines appended to filename
+    since the last check are parsed and added to the streams.
+
+    Yields:
+      Lists of the DamageStreams that were created or changed since
+      the previous list. DamageStreams are updated in place.
+
+    """
+    follower = log_parser.LogFollower(filename, keep_data=False)
+    builder = DamageStreamBuilder()
+    while True:
+        entries = follower.read_entries()
+        yield builder.add_entries(
+            e for e in entries
+            if e.entry_type == log_parser.LogEntry.COMBAT)
+        time.sleep(interval)
+
+
+def make_streams(your_damage_streams, enemy_damage_streams, enemy_info_map):
+    """Build DamageStreams from the intermediate maps of extract_streams.
+
+    your_damage_streams and enemy_damage_streams map (weapon, enemy_name)
+    to a list of (timestamp, damage_amount) pairs. enemy_info_map maps
+    enemy_name to a pair (ticker, set of ship types).
+
+    """
     damage_streams = []
     def add_streams(stream_map, enemy_attacks):
         for k, stream in stream_map.iteritems():
@@ -204,9 +484,35 @@ def extract_streams(log):
     return damage_streams
 
 
+def active_streams(streams, start, end):
+    """Return the DamageStreams in streams with damage in [start, end)."""
+    return [s for s in streams if s.is_active(start, end)]
+
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=log_parser.UTC())
+_NAIVE_EPOCH = datetime.datetime(1970, 1, 1)
+
+def timestamp_ms(dt):
+    """Return the milliseconds since the epoch of dt.
+
+    dt is a datetime.datetime. If it is naive, it is taken to be in UTC.
+
+    """
+    if dt.tzinfo is None:
+        d = dt - _NAIVE_EPOCH
+    else:
+        d = dt - _EPOCH
+    return (d.days * 86400 + d.seconds) * 1000.0 + d.microseconds / 1000.0
+
+
+def from_timestamp_ms(ms):
+    """Return the UTC datetime.datetime ms milliseconds after the epoch."""
+    return _EPOCH + datetime.timedelta(milliseconds=ms)
+
+
 def serialize(obj):
     if isinstance(obj, datetime.datetime):
-        return time.mktime(obj.timetuple()) * 1000
+        return timestamp_ms(obj)
     elif isinstance(obj, DamageStream):
         return obj.to_json_serializable()
     else:
@@ -215,11 +521,19 @@ def serialize(obj):
             % (type(obj), repr(obj)))
 
 
+def serialize_compact(obj):
+    """Like serialize, but DamageStreams are delta-encoded."""
+    if isinstance(obj, DamageStream):
+        return obj.to_compact_json_serializable()
+    return serialize(obj)
+
+
 if __name__ == '__main__':
     import json
     import sys
     html_template = open('template.html', 'r').read()
-    log = log_parser.Log.parse_log(sys.argv[1])
+    log = log_parser.Log.parse_log(sys.argv[1], lazy=True,
+                                       keep_data=False)
     streams = extract_streams(log)
     data = json.dumps(streams, default=serialize)
     print html_template % { 'json': data }
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# Copyright 2010 Matt Rudary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Combat statistics computed from DamageStreams with NumPy."""
+
+import calendar
+import datetime
+
+import numpy
+
+
+def stream_arrays(stream):
+    """Return the damage of a DamageStream as a pair of NumPy arrays.
+
+    The first array holds the seconds since the epoch of each point and
+    the second holds the amounts.
+
+    """
+    damage = list(stream.damage)
+    if not damage:
+        return (numpy.zeros(0, dtype=numpy.int64),
+                numpy.zeros(0, dtype=numpy.float64))
+    first = damage[0][0]
+    base = calendar.timegm(first.utctimetuple())
+    # Differences of datetimes are much cheaper than utctimetuple.
+    deltas = [t - first for t, amount in damage]
+    seconds = numpy.array([base + d.days * 86400 + d.seconds for d in deltas],
+                          dtype=numpy.int64)
+    amounts = numpy.array([amount for t, amount in damage],
+                          dtype=numpy.float64)
+    return seconds, amounts
+
+
+def stream_stats(stream, window=10, percentiles=(50, 90, 99),
+                 burst_factor=3.0, gap=30):
+    """Compute statistics of a DamageStream.
+
+    Args:
+      stream: A combat_log_analyzer.DamageStream.
+      window: The width in seconds of the windows DPS is measured over.
+          If the stream is shorter, there is one window covering all of
+          it.
+      percentiles: The percentiles of windowed DPS to report.
+      burst_factor: A second is a burst if its damage is more than this
+          many times the mean damage of the seconds with any damage.
+      gap: An engagement ends when there are more than this many
+          seconds with no attacks.
+
+    Returns:
+      A dict that combat_log_analyzer.serialize can encode, with keys
+        'duration': Seconds from the first to the last attack.
+        'mean_dps': Total damage over duration.
+        'peak_dps': The highest DPS over any window.
+        'peak_time': The start of the window with the highest DPS, which
+            need not be the time of an attack.
+        'window_dps_percentiles': A list of [percentile, DPS] pairs,
+            over the DPS of every window that fits in the stream.
+        'hit_seconds', 'miss_seconds': The number of seconds with and
+            without damage. A stream merges the attacks in each second,
+            so see hit_miss_by_weapon for counts of attacks.
+        'bursts': A list of [timestamp, amount] pairs.
+        'engagements': A list of [start, end, damage] triples.
+      Timestamps are datetime.datetimes from the stream.
+
+    """
+    times = [t for t, amount in stream.damage]
+    if not times:
+        return {}
+    seconds, amounts = stream_arrays(stream)
+    base = seconds[0]
+    offsets = seconds - base
+    duration = int(offsets[-1]) + 1
+
+    # Damage per second, and the DPS of the window starting at each
+    # second, from prefix sums. Only whole windows are counted, since
+    # the ones cut short by the end of the stream would understate DPS
+    # if divided by the full width, and overstate it if not.
+    per_second = numpy.bincount(offsets, weights=amounts, minlength=duration)
+    cumulative = numpy.concatenate(([0.0], numpy.cumsum(per_second)))
+    width = min(window, duration)
+    dps = (cumulative[width:] - cumulative[:-width]) / width
+    peak = int(numpy.argmax(dps))
+
+    hit = amounts > 0
+    hits = int(numpy.count_nonzero(hit))
+    bursts = []
+    if hits:
+        threshold = burst_factor * amounts[hit].mean()
+        bursts = [[times[i], float(amounts[i])]
+                  for i in numpy.flatnonzero(amounts > threshold)]
+
+    starts = numpy.concatenate(
+        ([0], numpy.flatnonzero(numpy.diff(seconds) > gap) + 1))
+    stops = numpy.concatenate((starts[1:], [len(seconds)])) - 1
+    engagement_damage = numpy.add.reduceat(amounts, starts)
+    engagements = [[times[start], times[stop], float(d)]
+                   for start, stop, d in zip(starts, stops,
+                                             engagement_damage)]
+
+    return {
+        'duration': duration,
+        'mean_dps': float(cumulative[-1]) / duration,
+        'peak_dps': float(dps[peak]),
+        'peak_time': times[0] + datetime.timedelta(seconds=peak),
+        'window_dps_percentiles': [[p, float(v)] for p, v in zip(
+                percentiles, numpy.percentile(dps, list(percentiles)))],
+        'hit_seconds': hits,
+        'miss_seconds': len(times) - hits,
+        'bursts': bursts,
+        'engagements': engagements,
+        }
+
+
+def hit_miss_by_weapon(table):
+    """Count the hits and misses of each weapon in a CombatTable.
+
+    Unlike a DamageStream, the table has one row per attack, so misses
+    in the same second as a hit are still counted.
+
+    Returns:
+      A list of [attacker, weapon, hits, misses] lists, where attacker
+      is 'You' or 'Enemy'.
+
+    """
+    if not len(table):
+        return []
+    is_you = numpy.array(
+        [name.strip().lower() == 'you' for name in table.names], dtype=bool)
+    enemy = (~is_you[table.attacker]).astype(numpy.int64)
+    key = enemy * len(table.weapons) + table.weapon
+    size = 2 * len(table.weapons)
+    hit = table.damage > 0
+    hits = numpy.bincount(key[hit], minlength=size)
+    misses = numpy.bincount(key[~hit], minlength=size)
+    result = []
+    for k in numpy.flatnonzero(hits + misses):
+        attacker = ('You', 'Enemy')[k // len(table.weapons)]
+        weapon = table.weapons[k % len(table.weapons)] or 'Unknown'
+        result.append([attacker, weapon, int(hits[k]), int(misses[k])])
+    return result
@@ -0,0 +1,253 @@
+#!/usr/bin/python
+# Copyright 2010 Matt Rudary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""A columnar representation of the combat entries of an Eve game log.
+
+This module requires NumPy. combat_log_analyzer does not, and the
+DamageStreams built here are the same as the ones it builds.
+
+"""
+
+import calendar
+import datetime
+
+import numpy
+
+import combat_log_analyzer
+import log_parser
+
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=log_parser.UTC())
+
+
+def _code(s, strings, codes):
+    """Return the index of s in strings, appending it if necessary."""
+    c = codes.get(s)
+    if c is None:
+        c = codes[s] = len(strings)
+        strings.append(s)
+    return c
+
+
+class CombatTable(object):
+    """The combat entries of a log, stored as parallel NumPy arrays.
+
+    The attacker and target columns hold indexes into names, and the
+    weapon column holds indexes into weapons.
+
+    """
+    def __init__(self, timestamps, damage, damage_is_int, attacker, target,
+                 weapon, names, weapons):
+        """Initialize a CombatTable.
+
+        timestamps is an array of integer seconds since the epoch (UTC),
+        in non-decreasing order. damage is an array of floats and
+        damage_is_int is a boolean array that is True where the parser
+        reported the amount as an int. attacker, target and weapon are
+        integer arrays. names and weapons are lists of strings.
+
+        """
+        self._timestamps = timestamps
+        self._damage = damage
+        self._damage_is_int = damage_is_int
+        self._attacker = attacker
+        self._target = target
+        self._weapon = weapon
+        self._names = names
+        self._weapons = weapons
+
+    @property
+    def timestamps(self):
+        """Seconds since the epoch of each entry, as an int64 array."""
+        return self._timestamps
+
+    @property
+    def damage(self):
+        """The damage dealt by each entry, as a float64 array."""
+        return self._damage
+
+    @property
+    def damage_is_int(self):
+        """A boolean array, True where the logged amount was an int."""
+        return self._damage_is_int
+
+    @property
+    def attacker(self):
+        """The index into names of the attacker of each entry."""
+        return self._attacker
+
+    @property
+    def target(self):
+        """The index into names of the target of each entry."""
+        return self._target
+
+    @property
+    def weapon(self):
+        """The index into weapons of the weapon used by each entry."""
+        return self._weapon
+
+    @property
+    def names(self):
+        """The attacker and target strings of the log."""
+        return self._names
+
+    @property
+    def weapons(self):
+        """The weapon strings of the log. May contain '' and None."""
+        return self._weapons
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    @classmethod
+    def from_log(cls, log):
+        """Build a CombatTable from the combat entries of a log_parser.Log.
+
+        The log's entries are read exactly once, so log may be lazy.
+
+        """
+        timestamps = []
+        damage = []
+        attacker = []
+        target = []
+        weapon = []
+        names = []
+        name_codes = {}
+        weapons = []
+        weapon_codes = {}
+        last_timestamp = None
+        seconds = None
+        for e in combat_log_analyzer.combat_entries(log):
+            if e.timestamp != last_timestamp:
+                last_timestamp = e.timestamp
+                seconds = calendar.timegm(last_timestamp.utctimetuple())
+            timestamps.append(seconds)
+            damage.append(e.damage)
+            attacker.append(_code(e.attacker, names, name_codes))
+            target.append(_code(e.target, names, name_codes))
+            weapon.append(_code(e.weapon, weapons, weapon_codes))
+
+        return cls(numpy.array(timestamps, dtype=numpy.int64),
+                   numpy.array(damage, dtype=numpy.float64),
+                   numpy.array([isinstance(d, (int, long)) for d in damage],
+                               dtype=bool),
+                   numpy.array(attacker, dtype=numpy.int32),
+                   numpy.array(target, dtype=numpy.int32),
+                   numpy.array(weapon, dtype=numpy.int32),
+                   names, weapons)
+
+    @classmethod
+    def parse_log(cls, log_file):
+        """Parse the given log file directly into a CombatTable.
+
+        See log_parser.Log.parse_log. Only the table is kept in memory.
+
+        """
+        return cls.from_log(
+            log_parser.Log.parse_log(log_file, lazy=True, keep_data=False))
+
+
+def extract_streams(table, registry=None):
+    """Extract damage streams from the given CombatTable.
+
+    This returns the same DamageStreams as
+    combat_log_analyzer.extract_streams does for the log the table was
+    built from. If registry, a combat_log_analyzer.EntityRegistry, is
+    given, it is used to resolve enemy id strings.
+
+    """
+    if registry is None:
+        registry = combat_log_analyzer.EntityRegistry()
+    n = len(table)
+    if n == 0:
+        return []
+    names = table.names
+    weapons = table.weapons
+
+    # Resolve each distinct attacker and enemy id string only once.
+    is_you = numpy.array([name.strip().lower() == 'you' for name in names],
+                         dtype=bool)
+    yours = is_you[table.attacker]
+    enemy = numpy.where(yours, table.target, table.attacker)
+
+    # Visit enemies in order of first appearance so that tickers and
+    # ship sets come out as they would entry by entry.
+    enemy_codes, first = numpy.unique(enemy, return_index=True)
+    enemy_names = []
+    enemy_name_codes = {}
+    enemy_name_code = numpy.zeros(len(names), dtype=numpy.int64)
+    enemy_info_map = {}
+    for c in enemy_codes[numpy.argsort(first, kind='mergesort')]:
+        enemy_name, ship, ticker = registry.resolve(names[c])
+        enemy_name_code[c] = _code(enemy_name, enemy_names, enemy_name_codes)
+        if ship is not None:
+            t, ship_types = enemy_info_map.setdefault(enemy_name,
+                                                      (ticker, set()))
+            ship_types.add(ship)
+
+    # Group entries by (yours, weapon, enemy_name), keeping each group
+    # in log order, then merge consecutive hits in the same second.
+    key = ((yours.astype(numpy.int64) * len(weapons) + table.weapon)
+           * len(enemy_names) + enemy_name_code[enemy])
+    order = numpy.argsort(key, kind='mergesort')
+    key = key[order]
+    timestamps = table.timestamps[order]
+    new_second = numpy.empty(n, dtype=bool)
+    new_second[0] = True
+    new_second[1:] = ((key[1:] != key[:-1])
+                      | (timestamps[1:] != timestamps[:-1]))
+    seconds = numpy.flatnonzero(new_second)
+    # Sum each second left to right, as extract_streams does, so that
+    # the floating point results are identical. This loops once per hit
+    # in the busiest second, not once per entry.
+    damage = table.damage[order]
+    lengths = numpy.diff(numpy.append(seconds, n))
+    amounts = damage[seconds]
+    for k in xrange(1, lengths.max()):
+        more = numpy.flatnonzero(lengths > k)
+        amounts[more] += damage[seconds[more] + k]
+    amount_is_int = numpy.logical_and.reduceat(table.damage_is_int[order],
+                                               seconds)
+    second_keys = key[seconds]
+    new_stream = numpy.empty(len(seconds), dtype=bool)
+    new_stream[0] = True
+    new_stream[1:] = second_keys[1:] != second_keys[:-1]
+    stream_starts = numpy.flatnonzero(new_stream)
+    stream_ends = numpy.append(stream_starts[1:], len(seconds))
+
+    datetimes = dict(
+        (s, _EPOCH + datetime.timedelta(seconds=s))
+        for s in numpy.unique(timestamps[seconds]).tolist())
+    times = [datetimes[s] for s in timestamps[seconds].tolist()]
+    amounts = [int(a) if i else a
+               for a, i in zip(amounts.tolist(), amount_is_int.tolist())]
+
+    streams = []
+    for start, end in zip(stream_starts.tolist(), stream_ends.tolist()):
+        i = order[seconds[start]]
+        streams.append((i, bool(yours[i]), weapons[table.weapon[i]],
+                        enemy_names[enemy_name_code[enemy[i]]],
+                        zip(times[start:end], amounts[start:end])))
+    streams.sort()
+
+    your_damage_streams = {}
+    enemy_damage_streams = {}
+    for i, your_stream, weapon, enemy_name, stream in streams:
+        if your_stream:
+            your_damage_streams[(weapon, enemy_name)] = stream
+        else:
+            enemy_damage_streams[(weapon, enemy_name)] = stream
+
+    return combat_log_analyzer.make_streams(
+        your_damage_streams, enemy_damage_streams, enemy_info_map)
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# Copyright 2010 Matt Rudary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Read gamelogs that may be gzip-, bz2- or zip-compressed.
+
+The logs are decompressed incrementally as they are read, so a
+compressed log can be passed to log_parser.Log.parse_log without
+holding the decompressed log in memory.
+
+"""
+
+import bz2
+import collections
+import gzip
+import zipfile
+
+
+# The errors that reading a corrupt compressed log may raise.
+ERRORS = (IOError, EOFError, zipfile.BadZipfile)
+
+_GZIP_MAGIC = '\x1f\x8b'
+_BZ2_MAGIC = 'BZh'
+_ZIP_MAGIC = 'PK\x03\x04'
+
+
+class BZ2Lines(object):
+    """A file-like iterator over the lines of a bz2-compressed file.
+
+    Unlike bz2.BZ2File, this reads from a file-like object rather than
+    a filename, and handles files made of several bz2 streams.
+
+    """
+    def __init__(self, infile, chunk_size=65536):
+        self._infile = infile
+        self._chunk_size = chunk_size
+        self._decompressor = bz2.BZ2Decompressor()
+        self._lines = collections.deque()
+        self._partial = ''
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while not self._lines:
+            if not self._fill():
+                if self._partial:
+                    line, self._partial = self._partial, ''
+                    return line
+                raise StopIteration
+        return self._lines.popleft()
+
+    def close(self):
+        self._infile.close()
+
+    def _fill(self):
+        """Decompress another chunk of lines. Returns False at the end."""
+        chunk = self._infile.read(self._chunk_size)
+        if not chunk:
+            return False
+        data = [self._partial]
+        while chunk:
+            try:
+                data.append(self._decompressor.decompress(chunk))
+            except EOFError:
+                # The previous stream ended with the previous chunk.
+                self._decompressor = bz2.BZ2Decompressor()
+                continue
+            chunk = self._decompressor.unused_data
+            if chunk:
+                self._decompressor = bz2.BZ2Decompressor()
+        lines = ''.join(data).split('\n')
+        self._partial = lines.pop()
+        self._lines.extend(line + '\n' for line in lines)
+        return True
+
+
+def open_logs(infile, name=''):
+    """Open each gamelog in infile.
+
+    Args:
+      infile: A seekable file-like object holding a gamelog, which may
+          be gzip-, bz2- or zip-compressed. A zip file may hold several
+          gamelogs.
+      name: The name of infile, if known.
+
+    Yields:
+      Pairs (name, log_file), where log_file is a file-like object that
+      decompresses the gamelog as it is read, suitable for
+      log_parser.Log.parse_log.
+
+    """
+    magic = infile.read(len(_ZIP_MAGIC))
+    infile.seek(0)
+    if magic.startswith(_GZIP_MAGIC):
+        yield name, gzip.GzipFile(fileobj=infile, mode='rb')
+    elif magic.startswith(_BZ2_MAGIC):
+        yield name, BZ2Lines(infile)
+    elif magic.startswith(_ZIP_MAGIC):
+        archive = zipfile.ZipFile(infile)
+        for info in archive.infolist():
+            if not info.filename.endswith('/'):
+                yield info.filename, archive.open(info)
+    else:
+        yield name, infile
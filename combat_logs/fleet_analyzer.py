@@ -0,0 +1,222 @@
+#!/usr/bin/python
+# Copyright 2010 Matt Rudary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Merge the combat logs of many pilots in the same fight.
+
+Each pilot's log records combat from their own point of view, with
+themselves as "You". This module rewrites "You" as the log's listener,
+merges the logs in timestamp order and builds DamageStreams for the
+whole fleet, keyed by (attacker, target, weapon).
+
+"""
+
+import heapq
+import itertools
+import sys
+
+import combat_log_analyzer
+import log_parser
+
+
+def listener_name(log, index):
+    """The name to use for the listener of log, the index'th log."""
+    return log.listener or 'Unknown pilot %d' % (index + 1)
+
+
+def attributed_entries(log, listener, registry):
+    """Generate the combat entries of log as tuples with named pilots.
+
+    Yields:
+      Tuples (timestamp, attacker, target, weapon, damage, attacker_id,
+      target_id). attacker and target are names, with "You" replaced
+      by listener and other id strings resolved through registry, an
+      EntityRegistry. attacker_id and target_id are the id strings
+      from the log, or None for the listener.
+
+    """
+    for e in combat_log_analyzer.combat_entries(log):
+        if e.attacker.strip().lower() == 'you':
+            attacker, attacker_id = listener, None
+        else:
+            attacker, attacker_id = registry.resolve(e.attacker)[0], e.attacker
+        if e.target.strip().lower() == 'you':
+            target, target_id = listener, None
+        else:
+            target, target_id = registry.resolve(e.target)[0], e.target
+        yield (e.timestamp, attacker, target, e.weapon, e.damage,
+               attacker_id, target_id)
+
+
+def merge_entries(entry_iterables):
+    """Merge timestamp-ordered iterables from attributed_entries.
+
+    The iterables are merged lazily with a heap, so only one entry from
+    each is held at a time.
+
+    Yields:
+      Pairs (index, entry), where index is the position in
+      entry_iterables of the iterable entry came from.
+
+    """
+    counter = itertools.count()
+    def tagged(index, entries):
+        for entry in entries:
+            yield entry[0], index, counter.next(), entry
+    for timestamp, index, n, entry in heapq.merge(
+        *[tagged(i, entries) for i, entries in enumerate(entry_iterables)]):
+        yield index, entry
+
+
+def dedupe_entries(merged):
+    """Drop the entries that more than one pilot logged.
+
+    A pilot shooting another fleet member shows up in both of their
+    logs, and overlapping logs from the same pilot repeat everything.
+    Within each second, entries with the same attacker, target and
+    damage are counted per log, and only the largest count is kept.
+    Entries that name a weapon are preferred.
+
+    Args:
+      merged: Pairs (index, entry) in timestamp order, as from
+          merge_entries.
+
+    Yields:
+      Entries, in timestamp order.
+
+    """
+    def flush(second):
+        # key = (attacker, target, damage), value = {index: [entry,...]}
+        for by_log in second.itervalues():
+            best = max(by_log.itervalues(),
+                       key=lambda entries: (len(entries),
+                                            sum(1 for e in entries if e[3])))
+            for entry in best:
+                yield entry
+
+    current = None
+    second = {}
+    for index, entry in merged:
+        if entry[0] != current:
+            for e in sorted(flush(second)):
+                yield e
+            current = entry[0]
+            second = {}
+        key = (entry[1], entry[2], entry[4])
+        second.setdefault(key, {}).setdefault(index, []).append(entry)
+    for e in sorted(flush(second)):
+        yield e
+
+
+def fleet_streams(merged, listeners):
+    """Build DamageStreams from merged, attributed entries.
+
+    Args:
+      merged: Pairs (index, entry) in timestamp order, as from
+          merge_entries. They are deduped with dedupe_entries.
+      listeners: The names of the fleet's pilots.
+
+    Tickers and ships describe whichever side of each stream is not one
+    of listeners, or the attacker if both are.
+
+    Returns:
+      A list of DamageStreams.
+
+    """
+    registry = combat_log_analyzer.EntityRegistry()
+    listeners = set(listeners)
+    # key = name, value = (ticker, set([ship1, ship2,...]))
+    info = {}
+    def with_info(merged):
+        # Entries dropped as duplicates may be the only ones that name a
+        # pilot's ship, so collect ships before deduping.
+        for index, entry in merged:
+            for name, id_string in ((entry[1], entry[5]),
+                                    (entry[2], entry[6])):
+                if id_string is not None:
+                    n, ship, ticker = registry.resolve(id_string)
+                    if ship is not None:
+                        info.setdefault(name, (ticker, set()))[1].add(ship)
+            yield index, entry
+
+    # key = (attacker, target, weapon), value = DamageStream
+    streams = {}
+    for (timestamp, attacker, target, weapon, damage,
+         attacker_id, target_id) in dedupe_entries(with_info(merged)):
+        key = (attacker, target, weapon)
+        stream = streams.get(key)
+        if stream is None:
+            stream = streams[key] = combat_log_analyzer.DamageStream(
+                attacker, target, [], weapon=weapon)
+        stream.add_damage(timestamp, damage)
+
+    for (attacker, target, weapon), stream in streams.iteritems():
+        if attacker in listeners and target not in listeners:
+            other = target
+        else:
+            other = attacker
+        ticker, ships = info.get(other, ('Unknown', []))
+        stream._set_enemy_info(ticker, ships)
+    return streams.values()
+
+
+def _parse_attributed(args):
+    """Parse one log for analyze_fleet in a worker process."""
+    index, filename = args
+    log = log_parser.Log.parse_log(filename, lazy=True, keep_data=False)
+    listener = listener_name(log, index)
+    return listener, list(attributed_entries(
+            log, listener, combat_log_analyzer.EntityRegistry()))
+
+
+def analyze_fleet(log_files, jobs=1):
+    """Merge the logs of many pilots in one fight into DamageStreams.
+
+    Args:
+      log_files: A list of filenames or file-like objects, one per
+          gamelog. See log_parser.Log.parse_log.
+      jobs: If greater than 1, parse the logs in this many worker
+          processes. log_files must then be filenames, and each log's
+          entries are held in memory until they are merged. Otherwise,
+          all the logs are read in step and never held in memory.
+
+    Returns:
+      A pair (listeners, streams): the listener of each log, in order,
+      and a list of DamageStreams.
+
+    """
+    if jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        try:
+            parsed = pool.map(_parse_attributed, list(enumerate(log_files)))
+        finally:
+            pool.close()
+            pool.join()
+        listeners = [listener for listener, entries in parsed]
+        entry_iterables = [entries for listener, entries in parsed]
+    else:
+        registry = combat_log_analyzer.EntityRegistry()
+        logs = [log_parser.Log.parse_log(f, lazy=True, keep_data=False)
+                for f in log_files]
+        listeners = [listener_name(log, i) for i, log in enumerate(logs)]
+        entry_iterables = [attributed_entries(log, listener, registry)
+                           for log, listener in zip(logs, listeners)]
+    return listeners, fleet_streams(merge_entries(entry_iterables), listeners)
+
+
+if __name__ == '__main__':
+    import json
+    listeners, streams = analyze_fleet(sys.argv[1:])
+    print json.dumps({ 'listeners': listeners, 'arr': streams },
+                     default=combat_log_analyzer.serialize)
@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# Copyright 2010 Matt Rudary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Optional timers and regex counters for the log parser's hot paths.
+
+Instrumentation is off unless enabled with instrumented():
+
+  with instrumentation.instrumented() as stats:
+      streams = combat_log_analyzer.extract_streams(
+          log_parser.Log.parse_log(filename, lazy=True))
+  print stats.to_json()
+
+While it is off, current is None and the instrumented code does nothing
+more than check that.
+
+Stages may nest; a lazy log's entries are parsed, and so timed as
+'parse_data', inside whichever stage reads them.
+
+"""
+
+import contextlib
+import json
+import logging
+import time
+
+
+# The Instrumentation that is collecting, or None.
+current = None
+
+
+class Instrumentation(object):
+    """Wall time per stage and match counts per regex."""
+    def __init__(self):
+        # key = stage, value = [calls, seconds]
+        self._stages = {}
+        # key = pattern set, value = {index: [matches, failed attempts]},
+        # where index None counts the lines that no pattern matched.
+        self._patterns = {}
+
+    def add_time(self, stage, seconds):
+        """Record a call of stage that took seconds."""
+        times = self._stages.get(stage)
+        if times is None:
+            times = self._stages[stage] = [0, 0.0]
+        times[0] += 1
+        times[1] += seconds
+
+    def count_match(self, pattern_set, index, failed_attempts):
+        """Record a regex match attempt on one line.
+
+        Args:
+          pattern_set: The name of the list of regexes that was tried,
+              e.g. '_V3_PHRASE_RES'.
+          index: The index in that list of the regex that matched, or
+              None if none did.
+          failed_attempts: The number of regexes tried that did not
+              match.
+
+        """
+        counts = self._patterns.setdefault(pattern_set, {}).get(index)
+        if counts is None:
+            counts = self._patterns[pattern_set][index] = [0, 0]
+        counts[0] += 1
+        counts[1] += failed_attempts
+
+    @property
+    def stages(self):
+        """A dict mapping each stage to a pair (calls, seconds)."""
+        return dict((stage, tuple(times))
+                    for stage, times in self._stages.iteritems())
+
+    @property
+    def patterns(self):
+        """A dict mapping (pattern set, index) to (lines, failed attempts).
+
+        index is None for the lines that no regex in the set matched.
+
+        """
+        return dict(((pattern_set, index), tuple(counts))
+                    for pattern_set, by_index in self._patterns.iteritems()
+                    for index, counts in by_index.iteritems())
+
+    def to_json_serializable(self):
+        """Convert the timers and counters to an object json can encode."""
+        return {
+            'stages': dict(
+                (stage, { 'calls': calls, 'seconds': seconds })
+                for stage, (calls, seconds) in self._stages.iteritems()),
+            'patterns': dict(
+                (pattern_set, [
+                        { 'index': index, 'lines': lines,
+                          'failed_attempts': failed }
+                        for index, (lines, failed)
+                        in sorted(by_index.iteritems())])
+                for pattern_set, by_index in self._patterns.iteritems()),
+            }
+
+    def to_json(self):
+        return json.dumps(self.to_json_serializable(), sort_keys=True)
+
+    def log(self, logger=logging, level=logging.INFO):
+        """Log the timers and counters as JSON."""
+        logger.log(level, 'Instrumentation: %s', self.to_json())
+
+
+class _Timer(object):
+    def __init__(self, stats, stage):
+        self._stats = stats
+        self._stage = stage
+
+    def __enter__(self):
+        self._start = time.time()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._stats.add_time(self._stage, time.time() - self._start)
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(stage):
+    """Return a context manager that times stage, if instrumentation is on."""
+    if current is None:
+        return _NULL_TIMER
+    return _Timer(current, stage)
+
+
+@contextlib.contextmanager
+def instrumented(stats=None):
+    """Turn instrumentation on within a with block.
+
+    Yields the Instrumentation that collects, which is stats if given.
+
+    """
+    global current
+    previous = current
+    current = stats if stats is not None else Instrumentation()
+    try:
+        yield current
+    finally:
+        current = previous
+
+
+@contextlib.contextmanager
+def suspended():
+    """Turn instrumentation off within a with block.
+
+    For work that would skew the counters, such as trying every parser
+    on a sample of lines to pick a format.
+
+    """
+    global current
+    previous = current
+    current = None
+    try:
+        yield
+    finally:
+        current = previous
@@ -0,0 +1,293 @@
+#!/usr/bin/python
+# Copyright 2010 Matt Rudary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Generate synthetic Eve gamelogs for benchmarking the log parser.
+
+Each session of a generated log is in one of the combat formats that
+log_parser understands: V3, complex or simplified. The first combat
+lines of a session use every phrase the parser knows for its format,
+in the order of CombatLogEntry's regexes, and the rest are chosen at
+random. Enemies are named with id strings of the shapes that
+combat_log_analyzer's _ENEMY_RE accepts, along with NPC names that it
+does not.
+
+"""
+
+import argparse
+import datetime
+import random
+import sys
+
+
+V3 = 'v3'
+COMPLEX = 'complex'
+SIMPLIFIED = 'simplified'
+FORMATS = (V3, COMPLEX, SIMPLIFIED)
+
+_FIRST_NAMES = ['Ruds', 'Mara', "O'Neil", 'Jax', 'Kei', 'Tor', 'Ana', 'Vel']
+_LAST_NAMES = ['Snikja', 'Kador', 'Tash-Murkon', 'Ix', 'Blackwood', 'Oru']
+_CORP_TICKERS = ['CORP', 'FLT', 'R-A', "D'O", 'X 1', 'BAD']
+_ALLIANCE_TICKERS = ['ALLY', '-10-', 'A B', 'SOL']
+_SHIP_NAMES = ["'Shiny'", "'Pod Saver'", "'Kill, Then Loot'"]
+_SHIP_TYPES = ['Drake', 'Rifter', 'Vexor Navy Issue', 'Tengu', 'Megathron',
+               'Sabre']
+_NPCS = ['Guristas Pirate', 'Serpentis Chief Safeguard', 'Angel Cartel Viper',
+         'Sansha Loyal Guard']
+_WEAPONS = ['Heavy Missile', 'Scourge Heavy Missile', 'Warrior II',
+            'Hammerhead II', '425mm Railgun II', 'Heavy Pulse Laser II',
+            'Mega Pulse Laser II', '720mm Howitzer Artillery II']
+_DRONES = ['Warrior II', 'Hammerhead II', 'Hornet EC-300', 'Ogre II']
+_EW = ['Warp scramble attempt', 'Warp disruption attempt', 'Stasis Webifier',
+       'Energy Neutralizer']
+_V3_QUALITIES = ['Glances Off', 'Grazes', 'Hits', 'Penetrates', 'Smashes',
+                 'Wrecks']
+_COMPLEX_DAMAGE = ['doing %s damage', 'inflicting %s damage',
+                   'causing %s damage', 'wrecking for %s damage',
+                   'inflicting <b>%s</b> damage']
+_COLORS = ['<color=0xffbb6600>', '<color=0xff00ffff>', '<color=0xffcc0000>']
+
+_OTHER_ENTRIES = [
+    ('notify', 'Interference from the warp disruption prevents you from '
+     'warping.'),
+    ('notify', 'Your cloak deactivates due to a pulse from a nearby ship.'),
+    ('info', 'Jumping from Jita to Perimeter'),
+    ('info', 'Undocking from Jita IV - Moon 4 - Caldari Navy Assembly Plant'),
+    ('warning', 'You cannot do that while warping.'),
+    ('question', 'Are you sure you want to quit the game?'),
+    ('hint', 'Attempting to join a channel'),
+    ('None', 'Target lost'),
+    ]
+
+
+def enemy_id(rng, dots=True):
+    """Return a random enemy id string or NPC name.
+
+    Unless dots is True, the result has no '.', which the simplified
+    format's miss phrases can't parse in a target.
+
+    """
+    if rng.random() < 0.15:
+        return rng.choice(_NPCS)
+    parts = [rng.choice(_FIRST_NAMES)]
+    if rng.random() < 0.8:
+        parts.append(' ' + rng.choice(_LAST_NAMES))
+    if rng.random() < 0.9:
+        parts.append(' [%s]' % rng.choice(_CORP_TICKERS))
+    if rng.random() < 0.6:
+        alliance = rng.choice(_ALLIANCE_TICKERS + (['A.B.'] if dots else []))
+        parts.append('&lt;%s&gt;' % alliance)
+    if rng.random() < 0.1:
+        parts.append(' ' + rng.choice(_SHIP_NAMES))
+    parts.append('(%s)' % rng.choice(_SHIP_TYPES))
+    return ''.join(parts)
+
+
+def _complex_damage(rng):
+    return ', ' + rng.choice(_COMPLEX_DAMAGE) % ('%.1f' % rng.uniform(1, 900))
+
+
+# Each complex line is a verb phrase of CombatLogEntry._VERB_PHRASES,
+# in the same order, with a subject of one of its _ATTACKER_PATTERNS.
+_COMPLEX_VERBS = [
+    lambda rng, a, t: '%s %shits %s%s.' % (
+        a, rng.choice(['', 'lightly ', 'heavily ']), t, _complex_damage(rng)),
+    lambda rng, a, t: '%s misses %s completely.' % (a, t),
+    lambda rng, a, t: '%s aims well at %s%s.' % (a, t, _complex_damage(rng)),
+    lambda rng, a, t: '%s barely scratches %s%s.' % (
+        a, t, _complex_damage(rng)),
+    lambda rng, a, t: '%s places an excellent hit on %s%s.' % (
+        a, t, _complex_damage(rng)),
+    lambda rng, a, t: '%s lands a hit on %s which glances off%s.' % (
+        a, t, _complex_damage(rng)),
+    lambda rng, a, t: '%s is well aimed at %s%s.' % (
+        a, t, _complex_damage(rng)),
+    lambda rng, a, t: '%s barely misses %s.' % (a, t),
+    lambda rng, a, t: '%s glances off %s%s.' % (a, t, _complex_damage(rng)),
+    lambda rng, a, t: '%s strikes %s perfectly%s.' % (
+        a, t, _complex_damage(rng)),
+    lambda rng, a, t: '%s perfectly strikes %s%s.' % (
+        a, t, _complex_damage(rng)),
+    ]
+
+_COMPLEX_SUBJECTS = [
+    lambda rng, listener: (
+        'Your %s%s' % (rng.choice(['', 'group of ']), rng.choice(_WEAPONS)),
+        enemy_id(rng)),
+    lambda rng, listener: (
+        '%s belonging to %s' % (rng.choice(_DRONES), listener),
+        enemy_id(rng)),
+    lambda rng, listener: (
+        rng.choice(['', rng.choice(_COLORS)]) + enemy_id(rng), 'you'),
+    ]
+
+
+def _complex_phrases():
+    return [(lambda rng, listener, verb=verb, subject=subject:
+                 verb(rng, *subject(rng, listener)))
+            for verb in _COMPLEX_VERBS for subject in _COMPLEX_SUBJECTS]
+
+
+def _simplified_damage(rng):
+    return 'for <b>%d</b> damage%s' % (
+        rng.randint(1, 900), rng.choice(['', '', ' (Wrecking!)']))
+
+
+# In the order of CombatLogEntry._SIMPLIFIED_PHRASES.
+_SIMPLIFIED_PHRASES = [
+    lambda rng, listener: '%s%s %s you %s' % (
+        rng.choice(_COLORS), enemy_id(rng, False),
+        rng.choice(['hits', 'strikes']), _simplified_damage(rng)),
+    lambda rng, listener: '%s %s %s %s' % (
+        rng.choice(_WEAPONS), rng.choice(['hits', 'strikes']),
+        enemy_id(rng, False), _simplified_damage(rng)),
+    lambda rng, listener: '%s%s misses you' % (
+        rng.choice(_COLORS), enemy_id(rng, False)),
+    lambda rng, listener: '%s misses %s' % (
+        rng.choice(_WEAPONS), enemy_id(rng, False)),
+    lambda rng, listener: '%s%s miss you' % (
+        rng.choice(_COLORS), enemy_id(rng, False)),
+    lambda rng, listener: '%s miss %s' % (
+        rng.choice(_DRONES), enemy_id(rng, False)),
+    ]
+
+
+def _v3_damage(rng, listener):
+    if rng.random() < 0.5:
+        return ('<color=0xff00ffff><b>%d</b> <color=0x77ffffff><font size=10>'
+                'to</font> <b><color=0xffffffff>%s</b><font size=10>'
+                '<color=0x77ffffff> - %s - %s' % (
+                rng.randint(1, 900), enemy_id(rng), rng.choice(_WEAPONS),
+                rng.choice(_V3_QUALITIES)))
+    return ('<color=0xffcc0000><b>%d</b> <color=0x77ffffff><font size=10>'
+            'from</font> <b><color=0xffffffff>%s</b><font size=10>'
+            '<color=0x77ffffff> - %s' % (
+            rng.randint(1, 900), enemy_id(rng), rng.choice(_V3_QUALITIES)))
+
+
+def _v3_miss(rng, listener):
+    weapon = rng.choice(_WEAPONS)
+    return 'Your %s misses %s completely - %s' % (
+        weapon, enemy_id(rng), weapon)
+
+
+# In the order of CombatLogEntry._V3_PHRASES.
+_V3_PHRASES = [
+    _v3_damage,
+    _v3_miss,
+    lambda rng, listener: '%s misses you completely' % enemy_id(rng),
+    lambda rng, listener: (
+        '<color=0xffffffff><b>%s</b> <color=0x77ffffff><font size=10>from'
+        '</font> <color=0xffffffff><b>%s</b> <color=0x77ffffff>'
+        '<font size=10>to <b><color=0xffffffff></font>you!' % (
+            rng.choice(_EW), enemy_id(rng))),
+    ]
+
+_PHRASES = {
+    V3: _V3_PHRASES,
+    COMPLEX: _complex_phrases(),
+    SIMPLIFIED: _SIMPLIFIED_PHRASES,
+    }
+
+
+def header(listener, start_time):
+    """Return the header lines of a session."""
+    return [
+        '-' * 60,
+        '  Gamelog',
+        '  Listener: %s' % listener,
+        '  Session Started: %s' % start_time.strftime('%Y.%m.%d %H:%M:%S'),
+        '-' * 60,
+        ]
+
+
+def generate_lines(num_lines, log_format, rng, listener='Ruds Snikja',
+                   start_time=datetime.datetime(2011, 2, 3, 10, 0, 0),
+                   combat_fraction=0.9):
+    """Generate the lines of one session, without line endings.
+
+    Args:
+      num_lines: The number of lines after the header.
+      log_format: One of FORMATS.
+      rng: A random.Random.
+      listener: The name of the session's pilot.
+      start_time: The session's start, a naive datetime in UTC.
+      combat_fraction: The fraction of lines that are combat entries.
+          The rest are other entries and continuation lines.
+
+    """
+    phrases = _PHRASES[log_format]
+    for line in header(listener, start_time):
+        yield line
+    t = start_time
+    num_combat = 0
+    for i in xrange(num_lines):
+        t += datetime.timedelta(seconds=rng.choice([0, 0, 0, 1, 1, 2]))
+        prefix = '[ %s ] ' % t.strftime('%Y.%m.%d %H:%M:%S')
+        # Start with one line of each phrase so that every one is used.
+        if num_combat < len(phrases) or rng.random() < combat_fraction:
+            if num_combat < len(phrases):
+                phrase = phrases[num_combat]
+            else:
+                phrase = rng.choice(phrases)
+            num_combat += 1
+            yield prefix + '(combat) ' + phrase(rng, listener)
+        elif rng.random() < 0.2:
+            yield 'a continuation of the previous message'
+        else:
+            yield prefix + '(%s) %s' % rng.choice(_OTHER_ENTRIES)
+
+
+def write_log(outfile, num_lines, formats=(COMPLEX,), seed=0,
+              newline='\r\n'):
+    """Write a gamelog with one session per format in formats.
+
+    The num_lines lines are split evenly between the sessions. A log
+    with more than one session must be read with
+    log_parser.Log.parse_sessions.
+
+    """
+    rng = random.Random(seed)
+    start_time = datetime.datetime(2011, 2, 3, 10, 0, 0)
+    for i, log_format in enumerate(formats):
+        n = num_lines // len(formats)
+        if i < num_lines % len(formats):
+            n += 1
+        for line in generate_lines(n, log_format, rng,
+                                   start_time=start_time):
+            outfile.write(line + newline)
+        start_time += datetime.timedelta(hours=1)
+
+
+def read_flags(argv):
+    parser = argparse.ArgumentParser(
+        prog=argv[0],
+        description='Write a synthetic Eve gamelog to standard output.')
+    parser.add_argument('-n', '--lines', type=int, default=10000,
+                        help='The number of lines after the headers.')
+    parser.add_argument('-f', '--format', dest='formats', action='append',
+                        choices=FORMATS,
+                        help='The combat format of a session. Repeat for '
+                        'a log with several sessions. Defaults to complex.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The random seed.')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    flags = read_flags(argv)
+    write_log(sys.stdout, flags.lines, flags.formats or [COMPLEX], flags.seed)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
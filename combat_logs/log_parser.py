@@ -15,15 +15,23 @@
 """Library to parse an eve game log.
 
 It is not unusual for multiple headers to occur in the same log
-file. This parser will not catch that, and so may associate events
-with the wrong character.
+file. Log.parse_log will not catch that, and so may associate events
+with the wrong character. Use Log.parse_sessions to get one Log per
+header instead.
 
 """
 
+import argparse
 import datetime
 import itertools
+import json
+import mmap
+import os
 import re
 import sys
+import time
+
+import instrumentation
 
 
 class UTC(datetime.tzinfo):
@@ -40,6 +48,8 @@ class UTC(datetime.tzinfo):
         return self._ZERO
 
 
+_UTC = UTC()
+
 _TIMESTAMP_PATTERN = (
     r'(?P<year>\d{4})\.(?P<month>\d{2})\.(?P<day>\d{2})'
     r' (?P<hour>\d{2}):(?P<min>\d{2}):(?P<sec>\d{2})')
@@ -56,6 +66,8 @@ class LogEntry(object):
     HINT = 6
     NONE = 7
 
+    __slots__ = ('_timestamp', '_entry_type', '_data')
+
     def __init__(self, timestamp, entry_type, data):
         self._timestamp = timestamp
         self._entry_type = entry_type
@@ -77,6 +89,19 @@ class LogEntry(object):
         r'^\[ %s \] \((?P<type>[^)]+)\) (?P<data>.+)$'
         % _TIMESTAMP_PATTERN)
 
+    _ENTRY_TYPES = {
+        'info': INFO,
+        'notify': NOTIFY,
+        'warning': WARNING,
+        'question': QUESTION,
+        'hint': HINT,
+        'None': NONE,
+        }
+
+    # The most recently decoded timestamp, as a pair (string, datetime).
+    # Consecutive lines usually share a timestamp.
+    _last_timestamp = (None, None)
+
     @classmethod
     def parse_line(cls, line, log):
         """Parse the given line and return a LogEntry.
@@ -86,38 +111,76 @@ class LogEntry(object):
         message and is usually because multiple lines of text were shown
         to a user.
         """
+        # Lines look like "[ YYYY.MM.DD HH:MM:SS ] (type) data". Slice
+        # the fixed-width prefix directly, falling back to the regex for
+        # anything unusual.
+        if line[:2] == '[ ' and line[21:25] == ' ] (':
+            close = line.find(')', 25)
+            if close > 25 and line[close + 1:close + 2] == ' ':
+                data = line[close + 2:]
+                if data and '\n' not in data:
+                    timestamp = cls._decode_timestamp(line[2:21])
+                    if timestamp is not None:
+                        return cls._make_entry(
+                            timestamp, line[25:close], data, log)
+
         m = cls._LOG_LINE_RE.match(line)
         if m is None:
             return None
-        entry_type = m.group('type')
         y, mo, d, h, mi, s = map(int, m.group('year', 'month', 'day',
                                               'hour', 'min', 'sec'))
-        timestamp = datetime.datetime(y, mo, d, h, mi, s, tzinfo = UTC())
-        data = m.group('data')
+        timestamp = datetime.datetime(y, mo, d, h, mi, s, tzinfo = _UTC)
+        return cls._make_entry(timestamp, m.group('type'), m.group('data'), log)
+
+    @staticmethod
+    def _decode_timestamp(ts):
+        """Decode "YYYY.MM.DD HH:MM:SS" into a datetime, or return None."""
+        last_ts, last_timestamp = LogEntry._last_timestamp
+        if ts == last_ts:
+            return last_timestamp
+        digits = ts[0:4] + ts[5:7] + ts[8:10] + ts[11:13] + ts[14:16] + ts[17:]
+        if (ts[4] != '.' or ts[7] != '.' or ts[10] != ' ' or ts[13] != ':'
+            or ts[16] != ':' or len(digits) != 14 or not digits.isdigit()):
+            return None
+        timestamp = datetime.datetime(
+            int(ts[0:4]), int(ts[5:7]), int(ts[8:10]),
+            int(ts[11:13]), int(ts[14:16]), int(ts[17:19]), tzinfo = _UTC)
+        LogEntry._last_timestamp = (ts, timestamp)
+        return timestamp
+
+    @staticmethod
+    def _make_entry(timestamp, entry_type, data, log):
         if entry_type == 'combat':
             return CombatLogEntry(timestamp, data, log)
-        else:
-            if entry_type == 'info':
-                t = LogEntry.INFO
-            elif entry_type == 'notify':
-                t = LogEntry.NOTIFY
-            elif entry_type == 'warning':
-                t = LogEntry.WARNING
-            elif entry_type == 'question':
-                t = LogEntry.QUESTION
-            elif entry_type == 'hint':
-                t = LogEntry.HINT
-            elif entry_type == 'None':
-                t = LogEntry.NONE
-            else:
-                raise ValueError('Unknown log entry type "%s".' % entry_type)
-            return LogEntry(timestamp, t, data)
+        try:
+            t = LogEntry._ENTRY_TYPES[entry_type]
+        except KeyError:
+            raise ValueError('Unknown log entry type "%s".' % entry_type)
+        return LogEntry(timestamp, t, data)
 
 
 class CombatLogEntry(LogEntry):
+    __slots__ = ('_target', '_attacker', '_weapon', '_damage')
+
     def __init__(self, timestamp, data, log):
+        """Parse data as a combat entry of the given log.
+
+        The attacker, target and weapon strings are interned in log. If
+        log.keep_data is False, data is discarded once it has been parsed.
+
+        """
         LogEntry.__init__(self, timestamp, LogEntry.COMBAT, data)
-        self._parse_data(log)
+        if instrumentation.current is None:
+            self._parse_data(log)
+        else:
+            with instrumentation.timed('parse_data'):
+                self._parse_data(log)
+        intern_name = log.intern_name
+        self._target = intern_name(self._target)
+        self._attacker = intern_name(self._attacker)
+        self._weapon = intern_name(self._weapon)
+        if not log.keep_data:
+            self._data = None
 
     @property
     def target(self):
@@ -140,23 +203,28 @@ class CombatLogEntry(LogEntry):
         return self._damage
 
     def _parse_data(self, log):
-        if log.log_type == Log.V3:
-            self._parse_v3()
-        elif log.log_type == Log.COMPLEX:
-            self._parse_complex()
-        elif log.log_type == Log.SIMPLIFIED:
-            self._parse_simple()
-        else:
-            try:
-                self._parse_v3()
-                log.log_type = Log.V3
-            except ValueError:
-                try:
-                    self._parse_simple()
-                    log.log_type = Log.SIMPLIFIED
-                except ValueError:
-                    self._parse_complex()
-                    log.log_type = Log.COMPLEX
+        """Parse data in the format of log, falling back to the others.
+
+        If log has no format yet, it takes the format of the first line
+        that parses.
+
+        """
+        parser = _PARSERS_BY_TYPE.get(log.log_type)
+        parsed = None
+        if parser is not None:
+            parsed = parser.parse(self._data)
+        if parsed is None:
+            for other in _PARSERS:
+                if other is not parser:
+                    parsed = other.parse(self._data)
+                    if parsed is not None:
+                        if log.log_type == Log.UNKNOWN:
+                            log.log_type = other.log_type
+                        break
+            else:
+                raise ValueError(
+                    'Could not parse """%s""" as combat.' % self._data)
+        self._attacker, self._target, self._weapon, self._damage = parsed
 
     _VERB_PHRASES = [
         '%(attacker)s (?:lightly |heavily )?hits %(target)s, %(damage)s\.$',
@@ -179,32 +247,39 @@ class CombatLogEntry(LogEntry):
 
     _DAMAGE_PATTERN = r'[^,]*?(?P<damage>\d+\.\d+)?(?:</b>)? damage'
 
-    _VERB_PHRASE_RES = [
-        re.compile(vp % { 'attacker': '(?:<color[^>]*>)?%s' % a,
-                          'target': '(?P<target>.*?)',
-                          'damage': _DAMAGE_PATTERN })
+    # _VERB_PHRASE_RES_BY_VERB[i] holds the regexes for _VERB_PHRASES[i],
+    # one per attacker pattern.
+    _VERB_PHRASE_RES_BY_VERB = [
+        [re.compile(vp % { 'attacker': '(?:<color[^>]*>)?%s' % a,
+                           'target': '(?P<target>.*?)',
+                           'damage': _DAMAGE_PATTERN })
+         for a in _ATTACKER_PATTERNS]
         for vp in _VERB_PHRASES
-        for a in _ATTACKER_PATTERNS
         ]
 
-    def _parse_complex(self):
-        m = None
-        for rex in self._VERB_PHRASE_RES:
-            m = rex.match(self._data)
-            if m is not None:
-                break
-        if m is None:
-            raise ValueError(
-                'Could not parse """%s""" as complex.' % self._data)
+    _VERB_PHRASE_RES = [rex for res in _VERB_PHRASE_RES_BY_VERB for rex in res]
+
+    # A literal that must appear in a line for the corresponding entry
+    # of _VERB_PHRASES to match it.
+    _VERB_KEYWORDS = [
+        'hits ',
+        'misses ',
+        'aims well at ',
+        'barely scratches ',
+        'places an excellent hit on ',
+        'lands a hit on ',
+        'is well aimed at ',
+        'barely misses ',
+        'glances off ',
+        'strikes ',
+        'perfectly strikes ',
+        ]
 
-        self._target = m.group('target')
-        self._attacker = m.group('attacker')
-        self._weapon = m.group('weapon')
-        damage = m.group('damage')
-        if damage is None:
-            self._damage = 0
-        else:
-            self._damage = float(damage)
+    _VERB_KEYWORD_INDEX = dict((k, i) for i, k in enumerate(_VERB_KEYWORDS))
+
+    # Finds every (possibly overlapping) occurrence of a keyword in one scan.
+    _VERB_KEYWORD_RE = re.compile(
+        '(?=(%s))' % '|'.join(re.escape(k) for k in _VERB_KEYWORDS))
 
     _SIMPLIFIED_PHRASES = [
         ('(?:<color[^>]*>)?(?P<attacker>.*) (?:hits|strikes) (?P<target>you) '
@@ -224,28 +299,6 @@ class CombatLogEntry(LogEntry):
         for sp in _SIMPLIFIED_PHRASES
         ]
 
-    def _parse_simple(self):
-        m = None
-        for rex in self._SIMPLIFIED_PHRASE_RES:
-            m = rex.match(self._data)
-            if m is not None:
-                break
-        if m is None:
-            raise ValueError('Could not parse """%s""" as simple.' % self._data)
-
-        self._target = m.group('target')
-        if self._target == 'you':
-            self._attacker = m.group('attacker')
-            self._weapon = ''
-        else:
-            self._attacker = 'You'
-            self._weapon = m.group('weapon')
-        damage = m.group('damage')
-        if damage:
-            self._damage = int(damage)
-        else:
-            self._damage = 0
-
     _V3_PHRASES = [
         ('<color[^>]*><b>(?P<damage>[0-9]+)'
          '</b> <color[^>]*><font[^>]*>(?P<preposition>.*)</font> '
@@ -262,43 +315,6 @@ class CombatLogEntry(LogEntry):
 
     _V3_PHRASE_RES = [re.compile(phrase) for phrase in _V3_PHRASES]
 
-    def _parse_v3(self):
-        m = None
-        for rex in self._V3_PHRASE_RES:
-            m = rex.match(self._data)
-            if m is not None:
-                break
-        if m is None:
-            raise ValueError('Could not parse """%s""" as V3' % self._data)
-
-        d = m.groupdict()
-        if 'preposition' in d:
-            p = d['preposition']
-            assert p == 'to' or p == 'from'
-            if p == 'to':
-                self._target = d['object']
-                self._attacker = 'You'
-            else:
-                self._target = 'you'
-                self._attacker = d['object']
-        else:
-            self._target = d['target']
-            if self._target == 'you':
-                self._attacker = d['attacker']
-            else:
-                self._attacker = 'You'
-
-        if self._target == 'you':
-            self._weapon = ''
-        else:
-            self._weapon = d['weapon']
-
-        if 'damage' in d:
-            self._damage = int(d['damage'])
-        else:
-            self._damage = 0
-
-
 class Log(object):
     # Log types:
     UNKNOWN = 0
@@ -307,13 +323,97 @@ class Log(object):
     V3 = 3
 
     """A log consists of some metadata and a sequence of log entries."""
-    def __init__(self, listener, start_time, infile):
+    def __init__(self, listener, start_time, infile, lazy=False,
+                 keep_data=True):
+        """Initialize a Log.
+
+        If lazy is False, every line of infile is parsed immediately.
+        Otherwise, lines are read and parsed only as log_entries is
+        iterated, and infile is closed once it has been exhausted.
+
+        If keep_data is False, the data of each CombatLogEntry is None.
+
+        The log's format is found by probe_format before any entries are
+        parsed.
+
+        """
         self._listener = listener
         self._start_time = start_time
         self.log_type = Log.UNKNOWN
-        self._log_entries = list(itertools.ifilter(
+        self.keep_data = keep_data
+        self._names = {}
+        lines = iter(infile)
+        sample = self.probe_format(lines)
+        lines = itertools.chain(sample, lines)
+        if lazy:
+            self._infile = infile
+            self._lines = lines
+            self._log_entries = None
+            self._num_entries = 0
+        else:
+            self._infile = None
+            self._log_entries = list(self._parse_entries(lines))
+            self._num_entries = len(self._log_entries)
+
+    # probe_format reads lines until it has seen this many combat
+    # entries, or _PROBE_MAX_LINES lines.
+    _PROBE_COMBAT_LINES = 20
+    _PROBE_MAX_LINES = 1000
+
+    def probe_format(self, lines):
+        """Set log_type from a sample of the combat entries in lines.
+
+        Each combat entry in the sample is parsed in every format, and
+        the format that parses the most of them wins, so that a single
+        odd line doesn't decide the format of the log. Ties go to the
+        format tried first, as in CombatLogEntry._parse_data. If no
+        entry parses, log_type is left UNKNOWN and set by the first
+        line that does.
+
+        Args:
+          lines: An iterator over the lines after the header. The sample
+              is read from it.
+
+        Returns:
+          A list of the lines read.
+
+        """
+        sample = []
+        counts = [0] * len(_PARSERS)
+        num_combat = 0
+        for line in lines:
+            sample.append(line)
+            m = LogEntry._LOG_LINE_RE.match(line.rstrip())
+            if m is not None and m.group('type') == 'combat':
+                data = m.group('data')
+                # Keep the probe out of the regex counters, which should
+                # count only the parse of each line.
+                with instrumentation.suspended():
+                    for i, parser in enumerate(_PARSERS):
+                        if parser.parse(data) is not None:
+                            counts[i] += 1
+                num_combat += 1
+                if num_combat >= self._PROBE_COMBAT_LINES:
+                    break
+            if len(sample) >= self._PROBE_MAX_LINES:
+                break
+        best = max(counts)
+        if best:
+            self.log_type = _PARSERS[counts.index(best)].log_type
+        return sample
+
+    def _parse_entries(self, lines):
+        return itertools.ifilter(
             None,
-            (LogEntry.parse_line(l.rstrip(), self) for l in infile)))
+            (LogEntry.parse_line(l.rstrip(), self) for l in lines))
+
+    def _stream_entries(self, infile, lines):
+        try:
+            for entry in self._parse_entries(lines):
+                self._num_entries += 1
+                yield entry
+        finally:
+            infile.close()
 
     @property
     def listener(self):
@@ -325,39 +425,122 @@ class Log(object):
         """A datetime.datetime indicating the time recording started."""
         return self._start_time
 
+    def intern_name(self, name):
+        """Return a string equal to name shared by all entries in this log."""
+        return self._names.setdefault(name, name)
+
+    @property
+    def lazy(self):
+        """True if entries are parsed only as log_entries is iterated."""
+        return self._log_entries is None
+
     @property
     def log_entries(self):
-        """An iterator to a sequence of LogEntry objects in timestamp order."""
-        return iter(self._log_entries)
+        """An iterator to a sequence of LogEntry objects in timestamp order.
+
+        For a lazy log, this may only be iterated once.
+
+        """
+        if self._log_entries is not None:
+            return iter(self._log_entries)
+        if self._infile is None:
+            raise ValueError('The entries of a lazy log may only be read once.')
+        # Take the file now, rather than when the generator starts, so
+        # that a second read fails here even if the first hasn't begun.
+        infile, lines = self._infile, self._lines
+        self._infile = self._lines = None
+        return self._stream_entries(infile, lines)
 
     @property
     def num_entries(self):
-        """The number of entries in this log."""
-        return len(self._log_entries)
+        """The number of entries in this log.
+
+        For a lazy log, this is the number of entries read so far.
+
+        """
+        return self._num_entries
 
     @classmethod
-    def parse_log(cls, log_file):
+    def parse_log(cls, log_file, lazy=False, keep_data=True):
         """Parse the given log file.
 
         Args:
           log_file: A filename or file-like object that contains a
               single gamelog. If log_file is a file-like object, it
-              will be closed before this function returns.
+              will be closed before this function returns, or, if
+              lazy is True, once the log's entries have been read.
+          lazy: If True, only the header is read now, and entries are
+              parsed one at a time as log_entries is iterated, so that
+              memory use does not grow with the size of the file.
+          keep_data: If False, the raw text of each combat entry is
+              discarded once it has been parsed.
 
         Returns:
           A Log object.
 
         """
-        if isinstance(log_file, basestring):
-            infile = open(log_file, 'r')
-        else:
-            infile = log_file
+        with instrumentation.timed('parse_log'):
+            if isinstance(log_file, basestring):
+                infile = open(log_file, 'r')
+            else:
+                infile = log_file
+
+            try:
+                with instrumentation.timed('_read_header'):
+                    listener, timestamp = cls._read_header(infile)
+                log = Log(listener, timestamp, infile, lazy, keep_data)
+            except:
+                infile.close()
+                raise
+            if not lazy:
+                infile.close()
+            return log
+
+    @classmethod
+    def iter_parse(cls, log_file, keep_data=True):
+        """Parse the given log file lazily. See parse_log."""
+        return cls.parse_log(log_file, lazy=True, keep_data=keep_data)
+
+    @classmethod
+    def parse_sessions(cls, filename, lazy=False, keep_data=True, jobs=1):
+        """Parse each session of the given log file into its own Log.
+
+        A session is a header and the entries that follow it, up to the
+        next header. The file is memory-mapped and split at header
+        boundaries without reading the entries.
+
+        Args:
+          filename: The name of a file containing one or more gamelogs.
+          lazy, keep_data: See parse_log.
+          jobs: If greater than 1, parse the sessions in this many
+              worker processes. The Logs are then never lazy.
 
+        Returns:
+          A list of Log objects, in file order.
+
+        """
+        infile = open(filename, 'rb')
         try:
-            listener, timestamp = cls._read_header(infile)
-            return Log(listener, timestamp, infile)
+            if os.fstat(infile.fileno()).st_size == 0:
+                raise ValueError('Cannot parse header -- too few lines.')
+            mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
         finally:
             infile.close()
+        sessions = find_sessions(mapped)
+        if jobs > 1 and len(sessions) > 1:
+            mapped.close()
+            import multiprocessing
+            pool = multiprocessing.Pool(min(jobs, len(sessions)))
+            try:
+                return pool.map(
+                    _parse_session,
+                    [(filename, start, end, keep_data)
+                     for start, end in sessions])
+            finally:
+                pool.close()
+                pool.join()
+        return [cls.parse_log(_MappedLines(mapped, start, end), lazy, keep_data)
+                for start, end in sessions]
 
     _MINUSES_RE = re.compile('^-+$')
     _GAMELOG_RE = re.compile('Gamelog')
@@ -386,7 +569,7 @@ class Log(object):
                 raise ValueError('Missing "Session started" line in header.')
             y, mo, d, h, mi, s = map(int, m.group('year', 'month', 'day',
                                                   'hour', 'min', 'sec'))
-            timestamp = datetime.datetime(y, mo, d, h, mi, s, tzinfo = UTC())
+            timestamp = datetime.datetime(y, mo, d, h, mi, s, tzinfo = _UTC)
             if not cls._MINUSES_RE.match(infile.next().rstrip()):
                 raise ValueError('Missing --- line to end header.')
 
@@ -395,11 +578,376 @@ class Log(object):
         return listener, timestamp
 
 
-if __name__ == '__main__':
-    for filename in sys.argv[1:]:
+class _ComplexParser(object):
+    """Parses the data of combat entries in the complex format.
+
+    Like the other parsers, parse returns a tuple (attacker, target,
+    weapon, damage), or None if data is not in this parser's format.
+
+    """
+    log_type = Log.COMPLEX
+
+    _VERB_PHRASE_RES_BY_VERB = CombatLogEntry._VERB_PHRASE_RES_BY_VERB
+    _VERB_KEYWORD_INDEX = CombatLogEntry._VERB_KEYWORD_INDEX
+    _VERB_KEYWORD_RE = CombatLogEntry._VERB_KEYWORD_RE
+    _NUM_ATTACKER_PATTERNS = len(CombatLogEntry._ATTACKER_PATTERNS)
+
+    def parse(self, data):
+        # Only the verb phrases whose keyword occurs in the line can
+        # match, so try just those, in the same order as
+        # _VERB_PHRASE_RES.
+        index = self._VERB_KEYWORD_INDEX
+        verbs = sorted(set(
+                index[k] for k in self._VERB_KEYWORD_RE.findall(data)))
+        m = None
+        for i, v in enumerate(verbs):
+            for j, rex in enumerate(self._VERB_PHRASE_RES_BY_VERB[v]):
+                m = rex.match(data)
+                if m is not None:
+                    break
+            if m is not None:
+                break
+        stats = instrumentation.current
+        if stats is not None:
+            n = self._NUM_ATTACKER_PATTERNS
+            if m is None:
+                stats.count_match('_VERB_PHRASE_RES', None, len(verbs) * n)
+            else:
+                stats.count_match('_VERB_PHRASE_RES', v * n + j, i * n + j)
+        if m is None:
+            return None
+
+        damage = m.group('damage')
+        if damage is None:
+            damage = 0
+        else:
+            damage = float(damage)
+        return (m.group('attacker'), m.group('target'), m.group('weapon'),
+                damage)
+
+
+class _SimplifiedParser(object):
+    """Parses the data of combat entries in the simplified format."""
+    log_type = Log.SIMPLIFIED
+
+    _SIMPLIFIED_PHRASE_RES = CombatLogEntry._SIMPLIFIED_PHRASE_RES
+
+    def parse(self, data):
+        m = None
+        for i, rex in enumerate(self._SIMPLIFIED_PHRASE_RES):
+            m = rex.match(data)
+            if m is not None:
+                break
+        stats = instrumentation.current
+        if stats is not None:
+            if m is None:
+                stats.count_match('_SIMPLIFIED_PHRASE_RES', None, i + 1)
+            else:
+                stats.count_match('_SIMPLIFIED_PHRASE_RES', i, i)
+        if m is None:
+            return None
+
+        target = m.group('target')
+        if target == 'you':
+            attacker = m.group('attacker')
+            weapon = ''
+        else:
+            attacker = 'You'
+            weapon = m.group('weapon')
+        damage = m.group('damage')
+        if damage:
+            damage = int(damage)
+        else:
+            damage = 0
+        return attacker, target, weapon, damage
+
+
+class _V3Parser(object):
+    """Parses the data of combat entries in the V3 format."""
+    log_type = Log.V3
+
+    _V3_PHRASE_RES = CombatLogEntry._V3_PHRASE_RES
+
+    def parse(self, data):
+        m = None
+        for i, rex in enumerate(self._V3_PHRASE_RES):
+            m = rex.match(data)
+            if m is not None:
+                break
+        stats = instrumentation.current
+        if stats is not None:
+            if m is None:
+                stats.count_match('_V3_PHRASE_RES', None, i + 1)
+            else:
+                stats.count_match('_V3_PHRASE_RES', i, i)
+        if m is None:
+            return None
+
+        d = m.groupdict()
+        if 'preposition' in d:
+            p = d['preposition']
+            if p == 'to':
+                target = d['object']
+                attacker = 'You'
+            elif p == 'from':
+                target = 'you'
+                attacker = d['object']
+            else:
+                return None
+        else:
+            target = d['target']
+            if target == 'you':
+                attacker = d['attacker']
+            else:
+                attacker = 'You'
+
+        if target == 'you':
+            weapon = ''
+        else:
+            weapon = d['weapon']
+
+        if 'damage' in d:
+            damage = int(d['damage'])
+        else:
+            damage = 0
+        return attacker, target, weapon, damage
+
+
+# The parsers, in the order formats are tried for a line that isn't in
+# its log's format.
+_PARSERS = [_V3Parser(), _SimplifiedParser(), _ComplexParser()]
+_PARSERS_BY_TYPE = dict((p.log_type, p) for p in _PARSERS)
+
+
+class LogFollower(object):
+    """Parses the entries appended to a growing log file.
+
+    The follower keeps a byte offset into the file, so each call to
+    read_entries only reads and parses the complete lines appended since
+    the previous call.
+
+    """
+    def __init__(self, filename, keep_data=True):
+        self._filename = filename
+        self._keep_data = keep_data
+        self._offset = 0
+        self._log = None
+
+    @property
+    def log(self):
+        """A Log holding the header, or None if it hasn't been read yet.
+
+        The Log's log_type is kept from call to call. Entries returned by
+        read_entries are not stored in it.
+
+        """
+        return self._log
+
+    @property
+    def offset(self):
+        """The byte offset of the first line not yet parsed."""
+        return self._offset
+
+    def read_entries(self):
+        """Parse the complete lines appended since the last call.
+
+        Returns:
+          A list of LogEntry objects. It is empty until the whole header
+          has been written.
+
+        """
+        infile = open(self._filename, 'rb')
         try:
-            log = Log.parse_log(filename)
-            print 'Log %s had %d entries.' % (filename, log.num_entries)
-        except ValueError, e:
-            print >>sys.stderr, 'Error parsing %s: %s.' % (filename, e)
+            size = os.fstat(infile.fileno()).st_size
+            if size < self._offset:
+                raise ValueError('Log file %s was truncated.' % self._filename)
+            infile.seek(self._offset)
+            data = infile.read(size - self._offset)
+        finally:
+            infile.close()
+        end = data.rfind('\n') + 1
+        lines = data[:end].split('\n')[:-1]
+        if not lines:
+            return []
 
+        if self._log is None:
+            header = _CountingFile(iter(lines))
+            try:
+                listener, timestamp = Log._read_header(header)
+            except ValueError:
+                if header.exhausted:
+                    # The rest of the header hasn't been written yet.
+                    return []
+                raise
+            self._log = Log(listener, timestamp, [], keep_data=self._keep_data)
+            lines = lines[header.num_lines:]
+
+        self._offset += end
+        log = self._log
+        return filter(None, (LogEntry.parse_line(l.rstrip(), log)
+                             for l in lines))
+
+
+_SESSION_START_RE = re.compile(r'^-+\r?\n[^\n]*Gamelog', re.M)
+
+def find_sessions(buf):
+    """Find the sessions in buf, a str or mmap holding a log file.
+
+    Returns a list of (start, end) byte offsets, one per header. Any
+    text before the first header is treated as a session of its own, so
+    that parsing it fails as parse_log would.
+
+    """
+    starts = [m.start() for m in _SESSION_START_RE.finditer(buf)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return zip(starts, starts[1:] + [len(buf)])
+
+
+class _MappedLines(object):
+    """A file-like iterator over the lines of buf between two offsets."""
+    def __init__(self, buf, start, end):
+        self._buf = buf
+        self._pos = start
+        self._end = end
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._pos >= self._end:
+            raise StopIteration
+        newline = self._buf.find('\n', self._pos, self._end)
+        if newline < 0:
+            stop = self._end
+        else:
+            stop = newline + 1
+        line = self._buf[self._pos:stop]
+        self._pos = stop
+        return line
+
+    def close(self):
+        # buf is shared between sessions; it is closed when collected.
+        pass
+
+
+def _parse_session(args):
+    """Parse one session for Log.parse_sessions in a worker process.
+
+    args is a tuple (filename, start, end, keep_data).
+
+    """
+    filename, start, end, keep_data = args
+    infile = open(filename, 'rb')
+    try:
+        mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        infile.close()
+    try:
+        return Log.parse_log(_MappedLines(mapped, start, end),
+                             keep_data=keep_data)
+    finally:
+        mapped.close()
+
+
+class _CountingFile(object):
+    """A file wrapper that counts the lines read from it."""
+    def __init__(self, infile):
+        self._infile = infile
+        self.num_lines = 0
+        self.exhausted = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            line = self._infile.next()
+        except StopIteration:
+            self.exhausted = True
+            raise
+        self.num_lines += 1
+        return line
+
+    def close(self):
+        self._infile.close()
+
+
+def _parse_file(args):
+    """Parse one file for main.
+
+    args is a pair (filename, streams). Returns a tuple (filename,
+    num_entries, num_lines, error, streams_json), where error is None
+    on success and streams_json is None unless streams is True.
+
+    """
+    filename, streams = args
+    infile = _CountingFile(open(filename, 'r'))
+    streams_json = None
+    try:
+        log = Log.parse_log(infile, lazy=True, keep_data=False)
+        if streams:
+            # combat_log_analyzer imports this module.
+            import combat_log_analyzer
+            streams_json = json.dumps(combat_log_analyzer.extract_streams(log),
+                                      default=combat_log_analyzer.serialize)
+        else:
+            for _ in log.log_entries:
+                pass
+    except ValueError, e:
+        return filename, 0, infile.num_lines, str(e), None
+    return filename, log.num_entries, infile.num_lines, None, streams_json
+
+
+def read_flags(argv):
+    parser = argparse.ArgumentParser(
+        prog=argv[0],
+        description='Parse Eve gamelogs and report how many entries each has.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='The number of processes to parse files with.')
+    parser.add_argument('--streams', action='store_true',
+                        help='Also print the damage streams of each log as '
+                        'JSON.')
+    parser.add_argument('files', metavar='<file>', nargs='*',
+                        help='A gamelog file.')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    flags = read_flags(argv)
+    tasks = [(filename, flags.streams) for filename in flags.files]
+    start = time.time()
+    if flags.jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(flags.jobs)
+        results = pool.imap(_parse_file, tasks)
+    else:
+        pool = None
+        results = itertools.imap(_parse_file, tasks)
+
+    num_files = 0
+    num_lines = 0
+    try:
+        for filename, entries, lines, error, streams_json in results:
+            num_files += 1
+            num_lines += lines
+            if error is not None:
+                print >>sys.stderr, 'Error parsing %s: %s.' % (filename, error)
+                continue
+            print 'Log %s had %d entries.' % (filename, entries)
+            if streams_json is not None:
+                print streams_json
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = max(time.time() - start, 1e-6)
+    print >>sys.stderr, (
+        'Parsed %d files (%d lines) in %.2fs: %.1f files/s, %.0f lines/s.'
+        % (num_files, num_lines, elapsed, num_files / elapsed,
+           num_lines / elapsed))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -14,15 +14,25 @@
 
 """Serve the log parser on appengine."""
 
+import hashlib
 import logging
+import pickle
 import StringIO
 import traceback
+import zipfile
+import zlib
 
 from django.utils import simplejson
+from google.appengine.api import memcache
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp.util import run_wsgi_app
 
 import combat_log_analyzer
+import combat_stats
+import combat_table
+import compressed_logs
+import fleet_analyzer
+import instrumentation
 import log_parser
 
 
@@ -34,29 +44,458 @@ class CustomJSONEncoder(simplejson.JSONEncoder):
             return simplejson.JSONEncoder.default(self, obj)
 
 
+class CompactJSONEncoder(simplejson.JSONEncoder):
+    def default(self, obj):
+        try:
+            return combat_log_analyzer.serialize_compact(obj)
+        except TypeError:
+            return simplejson.JSONEncoder.default(self, obj)
+
+
+# Parsed results are cached in memcache, which is size-bounded and
+# evicts least recently used values. The response to an upload and the
+# pickled streams of each of its gamelogs, for ParseWindow, are stored
+# under separate keys, each split into chunks of under memcache's 1 MB
+# limit on a value. A cached response is only served while all of its
+# gamelogs' streams are still cached. Bump _CACHE_VERSION whenever the output for
+# a given log changes.
+_CACHE_NAMESPACE = 'parse_file'
+_CACHE_VERSION = '9'
+_CHUNK_SIZE = 900 * 1024
+
+
+def upload_digest(infile, chunk_size=65536):
+    """Return a hex digest of the uploaded file infile.
+
+    infile is read a chunk at a time and then rewound.
+
+    """
+    digest = hashlib.sha1()
+    chunk = infile.read(chunk_size)
+    while chunk:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        digest.update(chunk)
+        chunk = infile.read(chunk_size)
+    infile.seek(0)
+    return digest.hexdigest()
+
+
+def cache_key(digest, output_format):
+    """Return the cache key for the response to an upload."""
+    return '%s:%s:%s' % (_CACHE_VERSION, output_format, digest)
+
+
+def window_key(key, index):
+    """Return the key ParseWindow finds the index'th gamelog's streams by.
+
+    key is the cache_key of the response the gamelog is in.
+
+    """
+    return '%s/%d' % (key, index)
+
+
+def _chunk_keys(key, count):
+    return ['%s#%d' % (key, i) for i in xrange(count)]
+
+
+def _set_multi(mapping):
+    """Set the values in mapping, returning whether all of them were set.
+
+    Failures, e.g. of values over memcache's size limit, are logged and
+    counted in the 'set_failures' counter.
+
+    """
+    try:
+        failed = memcache.set_multi(mapping, namespace=_CACHE_NAMESPACE)
+    except ValueError, e:
+        failed = e
+    if failed:
+        logging.info('Not caching %s: %s' % (', '.join(sorted(mapping)),
+                                             failed))
+        memcache.incr('set_failures', namespace=_CACHE_NAMESPACE,
+                      initial_value=0)
+        return False
+    return True
+
+
+def _set_chunked(key, data):
+    """Cache the string data under key in chunks; return whether it was."""
+    chunks = [data[i:i + _CHUNK_SIZE]
+              for i in xrange(0, len(data), _CHUNK_SIZE)] or ['']
+    # The chunks are set before their number is set under key, so that
+    # key is only found if the chunks were all set.
+    return (_set_multi(dict(zip(_chunk_keys(key, len(chunks)), chunks))) and
+            _set_multi({ key: len(chunks) }))
+
+
+def _get_chunked(key):
+    """Return the string cached by _set_chunked under key, or None."""
+    if not key:
+        return None
+    count = memcache.get(key, namespace=_CACHE_NAMESPACE)
+    if not isinstance(count, int):
+        return None
+    keys = _chunk_keys(key, count)
+    chunks = memcache.get_multi(keys, namespace=_CACHE_NAMESPACE)
+    if len(chunks) != count:
+        return None
+    return ''.join(chunks[k] for k in keys)
+
+
+def set_cached_streams(key, streams):
+    """Cache a gamelog's DamageStreams for ParseWindow.
+
+    Args:
+      key: The gamelog's window_key.
+      streams: A list of DamageStreams.
+
+    Returns:
+      Whether the streams were cached.
+
+    """
+    return _set_chunked(key, zlib.compress(pickle.dumps(streams, 2)))
+
+
+def get_cached_streams(key):
+    """Return the DamageStreams for a window_key, or None if not cached."""
+    data = _get_chunked(key)
+    if data is None:
+        return None
+    return pickle.loads(zlib.decompress(data))
+
+
+def get_cached(key):
+    """Return the zlib-compressed response data for key, or None.
+
+    A response whose gamelogs' streams are no longer all cached is not
+    returned, so that parsing it again caches them again.
+
+    """
+    entry = _get_chunked(key)
+    if entry is not None:
+        compressed, window_keys = pickle.loads(entry)
+        if all(_get_chunked(k) is not None for k in window_keys):
+            memcache.incr('hits', namespace=_CACHE_NAMESPACE,
+                          initial_value=0)
+            return compressed
+    memcache.incr('misses', namespace=_CACHE_NAMESPACE, initial_value=0)
+    return None
+
+
+def set_cached(key, compressed, window_keys):
+    """Cache the compressed response data for key.
+
+    Args:
+      key: The cache_key of the response.
+      compressed: The zlib-compressed response.
+      window_keys: The window_keys in the response, whose streams must
+          still be cached for the response to be served from the cache.
+
+    """
+    _set_chunked(key, pickle.dumps((compressed, window_keys), 2))
+
+
+class CompressingWriter(object):
+    """Writes to out, keeping a zlib-compressed copy of what was written."""
+    def __init__(self, out):
+        self._out = out
+        self._compressor = zlib.compressobj()
+        self._compressed = []
+
+    def write(self, data):
+        self._out.write(data)
+        self._compressed.append(self._compressor.compress(data))
+
+    def compressed(self):
+        """Return everything written so far, compressed. Call only once."""
+        self._compressed.append(self._compressor.flush())
+        return ''.join(self._compressed)
+
+
+def write_decompressed(out, compressed, chunk_size=65536):
+    """Write zlib-compressed data to out a chunk at a time."""
+    decompressor = zlib.decompressobj()
+    while compressed:
+        out.write(decompressor.decompress(compressed, chunk_size))
+        compressed = decompressor.unconsumed_tail
+    out.write(decompressor.flush())
+
+
+def write_json(out, output_obj, encoder):
+    """Write the dict output_obj to out as JSON.
+
+    Lists in output_obj, such as its DamageStreams, are encoded and
+    written one item at a time, so the whole encoded response is never
+    held in memory at once. Dicts in those lists are written the same
+    way.
+
+    """
+    out.write('{')
+    for i, (key, value) in enumerate(output_obj.iteritems()):
+        if i:
+            out.write(', ')
+        out.write(encoder.encode(key))
+        out.write(': ')
+        if isinstance(value, list):
+            out.write('[')
+            for j, item in enumerate(value):
+                if j:
+                    out.write(', ')
+                if isinstance(item, dict):
+                    write_json(out, item, encoder)
+                else:
+                    out.write(encoder.encode(item))
+            out.write(']')
+        else:
+            out.write(encoder.encode(value))
+    out.write('}')
+
+
 class ParseFile(webapp.RequestHandler):
     def post(self):
-        log_content = self.request.get('logfile')
-        logfile = StringIO.StringIO(log_content)
+        """Parse the uploaded logfile.
+
+        The upload may be gzip-, bz2- or zip-compressed, and is
+        decompressed as it is parsed. If it is a zip file with several
+        gamelogs, the response has a 'logs' list with one result per
+        gamelog, each with its 'name'.
+
+        If the request's format parameter is 'compact', the damage
+        streams are delta-encoded as described in
+        DamageStream.to_compact_json_serializable.
 
+        If the request's instrument parameter is set, the log is parsed
+        even if its response is cached, and the time spent in each stage
+        and the regex match counts are logged as JSON. See
+        instrumentation.
+
+        """
+        upload = self.request.POST.get('logfile')
+        if hasattr(upload, 'file'):
+            infile = upload.file
+            filename = upload.filename or ''
+        else:
+            infile = StringIO.StringIO(upload or '')
+            filename = ''
+        if self.request.get('format') == 'compact':
+            output_format = 'compact'
+            encoder = CompactJSONEncoder()
+        else:
+            output_format = 'pairs'
+            encoder = CustomJSONEncoder()
         self.response.headers['Content-Type'] = 'text/html; charset=utf-8'
-        output_obj = {}
+        out = self.response.out
+
+        out.write('<textarea>\n')
+        digest = upload_digest(infile)
+        key = cache_key(digest, output_format)
+        if self.request.get('instrument'):
+            with instrumentation.instrumented() as stats:
+                self.write_parsed(out, infile, filename, digest, key,
+                                  output_format, encoder)
+            stats.log()
+        else:
+            compressed = get_cached(key)
+            if compressed is not None:
+                write_decompressed(out, compressed)
+            else:
+                self.write_parsed(out, infile, filename, digest, key,
+                                  output_format, encoder)
+        out.write('\n</textarea>')
+
+    def write_parsed(self, out, infile, filename, digest, key, output_format,
+                     encoder):
+        """Parse the upload infile, write it to out as JSON and cache it."""
+        output_obj = self.parse_upload(infile, filename, key)
+        output_obj['format'] = output_format
+        writer = CompressingWriter(out)
+        with instrumentation.timed('json'):
+            write_json(writer, output_obj, encoder)
+        logs = output_obj.get('logs', [output_obj])
+        if not any('error' in log_obj for log_obj in logs):
+            set_cached(key, writer.compressed(),
+                       [log_obj['window_key'] for log_obj in logs
+                        if 'window_key' in log_obj])
+
+    def parse_upload(self, infile, filename, key):
+        """Parse each gamelog in the uploaded file infile.
+
+        Returns:
+          The object to send as JSON.
+
+        """
         try:
-            parsed = log_parser.Log.parse_log(logfile)
-            output_obj['arr'] = combat_log_analyzer.extract_streams(parsed)
+            logs = [self.parse(name, logfile, window_key(key, i))
+                    for i, (name, logfile)
+                    in enumerate(compressed_logs.open_logs(infile, filename))]
+        except compressed_logs.ERRORS, e:
+            logging.error('Could not open %s: %s' % (filename, e))
+            return { 'error': "Can't open file: %s" % e }
+        if len(logs) == 1:
+            return logs[0]
+        elif not logs:
+            return { 'error': "Can't parse file: no gamelogs found." }
+        return { 'logs': logs }
+
+    def parse(self, name, logfile, key):
+        """Parse the gamelog logfile and return an object to send as JSON.
+
+        The streams are cached under key for ParseWindow. If they could
+        be, the object's 'window_key' is key.
+
+        """
+        output_obj = { 'name': name }
+        try:
+            parsed = log_parser.Log.parse_log(logfile, lazy=True,
+                                             keep_data=False)
+            with instrumentation.timed('combat_table'):
+                table = combat_table.CombatTable.from_log(parsed)
+            with instrumentation.timed('extract_streams'):
+                streams = combat_table.extract_streams(table)
+            output_obj['arr'] = streams
+            with instrumentation.timed('combat_stats'):
+                output_obj['stats'] = [combat_stats.stream_stats(s)
+                                       for s in streams]
+                output_obj['weapons'] = combat_stats.hit_miss_by_weapon(
+                    table)
+            if set_cached_streams(key, streams):
+                output_obj['window_key'] = key
             if parsed.listener:
                 output_obj['Your'] = parsed.listener
             else:
                 output_obj['Your'] = 'Your'
-        except ValueError, e:
-            logging.error('Could not parse file: %s\n%s' % (e, log_content))
+        except compressed_logs.ERRORS + (ValueError,), e:
+            logging.error('Could not parse file %s: %s' % (name, e))
             logging.error(traceback.format_exc(e))
             output_obj['error'] = "Can't parse file: %s" % e
-        data = simplejson.dumps(output_obj, cls=CustomJSONEncoder)
-        self.response.out.write('<textarea>\n%s\n</textarea>' % data)
+        return output_obj
+
+
+class ParseBatch(webapp.RequestHandler):
+    def post(self):
+        """Merge the uploaded logfiles of several pilots in one fight.
+
+        Each logfile may be compressed as for ParseFile. The response
+        has the 'listeners' of the gamelogs and the fleet's damage
+        streams in 'arr', with each pilot's "You" replaced by their
+        name. See fleet_analyzer.
+
+        """
+        if self.request.get('format') == 'compact':
+            output_format = 'compact'
+            encoder = CompactJSONEncoder()
+        else:
+            output_format = 'pairs'
+            encoder = CustomJSONEncoder()
+        output_obj = self.parse_uploads(self.request.POST.getall('logfile'))
+        output_obj['format'] = output_format
+        self.response.headers['Content-Type'] = 'text/html; charset=utf-8'
+        out = self.response.out
+        out.write('<textarea>\n')
+        write_json(out, output_obj, encoder)
+        out.write('\n</textarea>')
+
+    def parse_uploads(self, uploads):
+        """Merge the gamelogs in uploads into an object to send as JSON."""
+        registry = combat_log_analyzer.EntityRegistry()
+        listeners = []
+        entry_iterables = []
+        try:
+            for upload in uploads:
+                if not hasattr(upload, 'file'):
+                    continue
+                for name, logfile in compressed_logs.open_logs(
+                    upload.file, upload.filename or ''):
+                    parsed = log_parser.Log.parse_log(logfile, lazy=True,
+                                                     keep_data=False)
+                    listener = fleet_analyzer.listener_name(parsed,
+                                                            len(listeners))
+                    entries = fleet_analyzer.attributed_entries(
+                        parsed, listener, registry)
+                    if isinstance(logfile, zipfile.ZipExtFile):
+                        # The members of a zip file all read from the
+                        # upload, so they can't be merged in step.
+                        entries = list(entries)
+                    listeners.append(listener)
+                    entry_iterables.append(entries)
+            if not entry_iterables:
+                return { 'error': "Can't parse files: no gamelogs found." }
+            streams = fleet_analyzer.fleet_streams(
+                fleet_analyzer.merge_entries(entry_iterables), listeners)
+        except compressed_logs.ERRORS + (ValueError,), e:
+            logging.error('Could not parse batch: %s' % e)
+            logging.error(traceback.format_exc(e))
+            return { 'error': "Can't parse files: %s" % e }
+        return {
+            'listeners': listeners,
+            'arr': streams,
+            'stats': [combat_stats.stream_stats(s) for s in streams],
+            }
+
+
+class ParseWindow(webapp.RequestHandler):
+    def get(self):
+        """Serve the damage of a parsed gamelog in a window of time.
+
+        The key parameter is the 'window_key' of a ParseFile response,
+        and start and end are milliseconds since the epoch. The
+        response has the streams with damage at times t with
+        start <= t < end, cut down to that window, in 'arr'; their
+        positions in the full response's 'arr' in 'indexes'; and their
+        DPS over the window in 'dps'. If the streams are no longer
+        cached, the response has an 'error' and the log must be
+        uploaded again.
+
+        """
+        if self.request.get('format') == 'compact':
+            output_format = 'compact'
+            encoder = CompactJSONEncoder()
+        else:
+            output_format = 'pairs'
+            encoder = CustomJSONEncoder()
+        output_obj = { 'format': output_format }
+        try:
+            start = combat_log_analyzer.from_timestamp_ms(
+                float(self.request.get('start')))
+            end = combat_log_analyzer.from_timestamp_ms(
+                float(self.request.get('end')))
+        except (ValueError, OverflowError), e:
+            output_obj['error'] = 'Bad window: %s' % e
+            streams = []
+        else:
+            streams = get_cached_streams(self.request.get('key'))
+            if streams is None:
+                output_obj['error'] = 'Log expired; please upload it again.'
+                streams = []
+        indexes = [i for i, s in enumerate(streams)
+                   if s.is_active(start, end)]
+        output_obj['indexes'] = indexes
+        output_obj['arr'] = [streams[i].window(start, end) for i in indexes]
+        output_obj['dps'] = [streams[i].dps_between(start, end)
+                             for i in indexes]
+        self.response.headers['Content-Type'] = 'application/json'
+        write_json(self.response.out, output_obj, encoder)
+
+
+class CacheStats(webapp.RequestHandler):
+    def get(self):
+        stats = memcache.get_multi(['hits', 'misses', 'set_failures'],
+                                   namespace=_CACHE_NAMESPACE)
+        output_obj = {
+            'hits': stats.get('hits', 0),
+            'misses': stats.get('misses', 0),
+            'set_failures': stats.get('set_failures', 0),
+            'memcache': memcache.get_stats(),
+            }
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(simplejson.dumps(output_obj))
 
 
-application = webapp.WSGIApplication([('/parse_file', ParseFile)])
+application = webapp.WSGIApplication([('/parse_file', ParseFile),
+                                      ('/parse_file/cache_stats', CacheStats),
+                                      ('/parse_file/window', ParseWindow),
+                                      ('/parse_batch', ParseBatch)])
 
 
 def main():
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+# Copyright 2010 Matt Rudary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the window queries of parse_file, with memcache stubbed."""
+
+import json
+import StringIO
+import unittest
+
+import log_generator
+import parse_file
+
+
+class FakeMemcache(object):
+    """Just enough of memcache for parse_file, with explicit eviction."""
+    def __init__(self, max_size=1000000):
+        self.values = {}
+        self.max_size = max_size
+
+    def get(self, key, namespace=None):
+        return self.values.get((namespace, key))
+
+    def get_multi(self, keys, namespace=None):
+        return dict((key, self.values[(namespace, key)]) for key in keys
+                    if (namespace, key) in self.values)
+
+    def set_multi(self, mapping, namespace=None):
+        for key, value in mapping.iteritems():
+            if isinstance(value, str) and len(value) > self.max_size:
+                raise ValueError('Values may not be more than %d bytes in '
+                                 'length; received %d bytes'
+                                 % (self.max_size, len(value)))
+        for key, value in mapping.iteritems():
+            self.values[(namespace, key)] = value
+        return []
+
+    def incr(self, key, namespace=None, initial_value=0):
+        self.values[(namespace, key)] = (
+            self.values.get((namespace, key), initial_value) + 1)
+
+    def evict_all_but(self, key):
+        """Evict every value but key's, as memcache may under pressure."""
+        for namespace, k in self.values.keys():
+            if k != key:
+                del self.values[(namespace, k)]
+
+
+class FakeUpload(object):
+    def __init__(self, data, filename):
+        self.file = StringIO.StringIO(data)
+        self.filename = filename
+
+
+class FakeRequest(object):
+    def __init__(self, args, upload=None):
+        self.args = args
+        self.POST = {}
+        if upload is not None:
+            self.POST['logfile'] = upload
+
+    def get(self, key):
+        return self.args.get(key, '')
+
+
+class FakeResponse(object):
+    def __init__(self):
+        self.headers = {}
+        self.out = StringIO.StringIO()
+
+
+class ParseWindowTest(unittest.TestCase):
+    def setUp(self):
+        self.memcache = FakeMemcache()
+        self.real_memcache = parse_file.memcache
+        parse_file.memcache = self.memcache
+        log = StringIO.StringIO()
+        log_generator.write_log(log, 200, seed=1)
+        self.log = log.getvalue()
+
+    def tearDown(self):
+        parse_file.memcache = self.real_memcache
+
+    def upload(self):
+        handler = parse_file.ParseFile()
+        handler.request = FakeRequest({}, FakeUpload(self.log, 'log.txt'))
+        handler.response = FakeResponse()
+        handler.post()
+        body = handler.response.out.getvalue()
+        return json.loads(body[len('<textarea>\n'):-len('\n</textarea>')])
+
+    def window(self, **args):
+        handler = parse_file.ParseWindow()
+        handler.request = FakeRequest(args)
+        handler.response = FakeResponse()
+        handler.get()
+        return json.loads(handler.response.out.getvalue())
+
+    def full_window(self, parsed):
+        start = min(s['start_time'] for s in parsed['arr'])
+        end = max(s['end_time'] for s in parsed['arr']) + 1000
+        return self.window(key=parsed['window_key'], start=str(start),
+                           end=str(end))
+
+    def testWindow(self):
+        parsed = self.upload()
+        result = self.full_window(parsed)
+        self.assertFalse('error' in result)
+        self.assertEqual(range(len(parsed['arr'])), result['indexes'])
+
+    def response_key(self):
+        return parse_file.cache_key(
+            parse_file.upload_digest(StringIO.StringIO(self.log)), 'pairs')
+
+    def testStreamsEvicted(self):
+        parsed = self.upload()
+        self.memcache.evict_all_but(self.response_key())
+        self.assertEqual('Log expired; please upload it again.',
+                         self.full_window(parsed)['error'])
+        reparsed = self.upload()
+        self.assertEqual(parsed['window_key'], reparsed['window_key'])
+        self.assertEqual(1, self.memcache.get('misses', 'parse_file'))
+        result = self.full_window(reparsed)
+        self.assertFalse('error' in result)
+        self.assertEqual(range(len(parsed['arr'])), result['indexes'])
+
+    def testReuploadAfterEviction(self):
+        parsed = self.upload()
+        self.memcache.evict_all_but(None)
+        self.assertEqual('Log expired; please upload it again.',
+                         self.full_window(parsed)['error'])
+        self.upload()
+        self.assertFalse('error' in self.full_window(parsed))
+
+    def testCachedResponseHasStreams(self):
+        parsed = self.upload()
+        cached = self.upload()
+        self.assertEqual(parsed, cached)
+        self.assertFalse('error' in self.full_window(cached))
+
+    def testChunked(self):
+        parse_file._CHUNK_SIZE, chunk_size = 1000, parse_file._CHUNK_SIZE
+        try:
+            parsed = self.upload()
+            self.assertEqual(parsed, self.upload())
+        finally:
+            parse_file._CHUNK_SIZE = chunk_size
+        self.assertEqual(1, self.memcache.get('hits', 'parse_file'))
+        self.assertTrue(self.memcache.get(parsed['window_key'],
+                                          'parse_file') > 1)
+        self.assertTrue(self.memcache.get(self.response_key(),
+                                          'parse_file') > 1)
+        self.assertEqual(range(len(parsed['arr'])),
+                         self.full_window(parsed)['indexes'])
+        self.memcache.evict_all_but(parsed['window_key'])
+        self.assertEqual('Log expired; please upload it again.',
+                         self.full_window(parsed)['error'])
+
+    def testTooBigToCache(self):
+        self.memcache.max_size = 1000
+        parsed = self.upload()
+        self.assertFalse('window_key' in parsed)
+        self.assertTrue(parsed['arr'])
+        self.assertEqual(None, self.memcache.get(self.response_key(),
+                                                 'parse_file'))
+        self.assertEqual(2, self.memcache.get('set_failures', 'parse_file'))
+
+    def testBadWindow(self):
+        key = self.upload()['window_key']
+        for start, end in (('x', '1'), ('inf', '1'), ('0', '1e300'),
+                           ('nan', '1')):
+            result = self.window(key=key, start=start, end=end)
+            self.assertTrue(result['error'].startswith('Bad window'),
+                            (start, end))
+            self.assertEqual([], result['arr'])
+
+
+if __name__ == '__main__':
+    unittest.main()
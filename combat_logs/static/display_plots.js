@@ -151,6 +151,42 @@ var reset_boundaries = function() {
     $.map(log_data, function (val) { return val.end_time; }));
 };
 
+// Expand a stream sent in the compact format (see
+// DamageStream.to_compact_json_serializable) into [ms, amount] pairs.
+var decode_compact = function(damage_stream) {
+  var damage = new Array(damage_stream.offsets.length);
+  var t = damage_stream.base_time;
+  for (var i = 0; i < damage.length; i++) {
+    t += damage_stream.offsets[i] * 1000;
+    damage[i] = [t, damage_stream.amounts[i]];
+  }
+  damage_stream.damage = damage;
+  delete damage_stream.base_time;
+  delete damage_stream.offsets;
+  delete damage_stream.amounts;
+  return damage_stream;
+};
+
+var decode_log = function(data, format) {
+  if (format == 'compact' && data.arr) {
+    $.each(data.arr, function(idx, val) { decode_compact(val); });
+  }
+};
+
+var show_log = function(data) {
+  var $out = $('#upload_status');
+  if (data.error) {
+    $out.html('<pre>' + data.error + '</pre>');
+  } else {
+    $('#your_dps_h1').html(data.Your + ' DPS');
+    log_data = data.arr;
+    reset_boundaries();
+    render();
+    $out.html('');
+    $('#download_form').css('visibility', 'visible');
+  }
+};
+
 var log_data = [];
 var min = 0;
 var max = Infinity;
@@ -164,16 +200,23 @@ $(document).ready(
           $('#upload_status').html('Processing...');
         },
         success: function(data) {
-          var $out = $('#upload_status');
-          if (data.error) {
-            $out.html('<pre>' + data.error + '</pre>');
+          if (data.logs) {
+            // A zip file with several gamelogs; let the user pick one.
+            var $select = $('#log_select');
+            $select.empty();
+            $.each(data.logs, function(idx, val) {
+              decode_log(val, data.format);
+              $select.append($('<option>').val(idx).text(val.name));
+            });
+            $select.unbind('change').change(function() {
+              show_log(data.logs[$select.val()]);
+            });
+            $select.css('visibility', 'visible');
+            show_log(data.logs[0]);
           } else {
-            $('#your_dps_h1').html(data.Your + ' DPS');
-            log_data = data.arr;
-            reset_boundaries();
-            render();
-            $out.html('');
-            $('#download_form').css('visibility', 'visible');
+            $('#log_select').css('visibility', 'hidden');
+            decode_log(data, data.format);
+            show_log(data);
           }
         }
       });
@@ -1,6 +1,7 @@
 #!/usr/bin/python
 
 import argparse
+import hashlib
 import sqlite3
 import sys
 
@@ -11,6 +12,11 @@ def read_flags(argv):
                      'and how far they are from Jita.'))
     parser.add_argument('dbfile', metavar='<dbfile>',
                         help='The file containing the Eve static data dump.')
+    parser.add_argument('--incremental', action='store_true',
+                        help=('Do nothing if the jump graph is unchanged '
+                              'since the table was last written, and '
+                              'otherwise only rewrite the rows that '
+                              'changed.'))
     return parser.parse_args(argv[1:])
 
 def read_graph(conn):
@@ -76,7 +82,123 @@ def compute_distance(adjacency, start='Jita'):
     for k, v in d.iteritems():
         yield k, v, p[k]
 
-def write_table(conn, entries):
+_TABLE = 'rudsmapjitadistance'
+_META_TABLE = 'rudsmapjitadistancemeta'
+_BATCH_SIZE = 1000
+
+def tune_connection(conn):
+    """Set pragmas that make bulk writes to conn fast.
+
+    Writes are not synced to disk and the journal is kept in memory, so
+    a crash while writing may corrupt the database. The table can
+    always be rebuilt from the static data dump.
+    """
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA synchronous = OFF;')
+    cursor.execute('PRAGMA journal_mode = MEMORY;')
+    cursor.execute('PRAGMA temp_store = MEMORY;')
+    cursor.execute('PRAGMA cache_size = -65536;')
+
+def mapjumps_fingerprint(conn):
+    """Return a hex digest of the jump graph and the systems' names.
+
+    The digest covers every row read_graph reads: the jumps between
+    stargates, the system each stargate is in, and the systems' names.
+    """
+    digest = hashlib.sha1()
+    cursor = conn.cursor()
+    for query in ('SELECT stargateID, celestialID FROM mapjumps '
+                  'ORDER BY stargateID, celestialID;',
+                  'SELECT itemID, solarSystemID FROM mapdenormalize '
+                  'WHERE groupID = 10 ORDER BY itemID;',
+                  'SELECT solarSystemID, solarSystemName '
+                  'FROM mapsolarsystems ORDER BY solarSystemID;'):
+        cursor.execute(query)
+        for row in cursor:
+            digest.update(repr(tuple(row)))
+        digest.update('\n')
+    return digest.hexdigest()
+
+def _table_exists(cursor, table):
+    cursor.execute("SELECT 1 FROM sqlite_master "
+                   "WHERE type = 'table' AND name = ?;", (table,))
+    return cursor.fetchone() is not None
+
+def read_fingerprint(conn):
+    """Return the fingerprint the table was last written with, or None."""
+    cursor = conn.cursor()
+    if not (_table_exists(cursor, _TABLE) and
+            _table_exists(cursor, _META_TABLE)):
+        return None
+    cursor.execute('SELECT value FROM %s WHERE key = ?;' % _META_TABLE,
+                   ('mapjumps_fingerprint',))
+    row = cursor.fetchone()
+    return row and row[0]
+
+def _batches(rows, size=_BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _create_table(cursor):
+    cursor.execute('DROP TABLE IF EXISTS %s;' % _TABLE)
+    cursor.execute('CREATE TABLE %s ('
+                   ' solarSystemID INT(11), '
+                   ' solarSystemName VARCHAR(100), '
+                   ' distance INT(11), '
+                   ' nextSolarSystemID INT(11), '
+                   ' nextSolarSystemName VARCHAR(100));' % _TABLE)
+
+def _create_indexes(cursor):
+    # Created after the rows are loaded, which is much faster than
+    # updating the indexes row by row.
+    cursor.execute('CREATE UNIQUE INDEX %s_id ON %s (solarSystemID);'
+                   % (_TABLE, _TABLE))
+    cursor.execute('CREATE INDEX %s_name ON %s (solarSystemName);'
+                   % (_TABLE, _TABLE))
+
+def _changed_rows(cursor, rows):
+    """Compare rows to the table.
+
+    Returns:
+        A pair (changed, removed): the rows that are new or differ from
+        the table, and the solarSystemIDs in the table but not in rows.
+    """
+    cursor.execute('SELECT solarSystemID, solarSystemName, distance, '
+                   'nextSolarSystemID, nextSolarSystemName FROM %s;' % _TABLE)
+    # Compare as strings, since SQLite converts values to the column
+    # types; e.g. a nextSolarSystemName of 0 is read back as u'0'.
+    key = lambda row: tuple(unicode(x) for x in row)
+    old = dict((row[0], key(row)) for row in cursor)
+    changed = []
+    for row in rows:
+        if old.pop(row[0], None) != key(row):
+            changed.append(row)
+    return changed, old.keys()
+
+def write_table(conn, entries, incremental=False, fingerprint=None):
+    """Write entries, as from compute_distance, to rudsmapjitadistance.
+
+    Everything is written in one transaction, with executemany. Unless
+    incremental is True, the table is dropped and rebuilt, and its
+    indexes are created after the rows are loaded. If incremental is
+    True and the table exists, only the rows that changed are written.
+
+    Args:
+        conn: A Connection.
+        entries: An iterable of (SolarSystem, Distance, Next System).
+        incremental: Whether to update the existing table in place.
+        fingerprint: If given, the mapjumps_fingerprint to record, so
+            that an incremental run can tell the table is up to date.
+
+    Returns:
+        The number of rows written or deleted.
+    """
     cursor = conn.cursor()
     cursor.execute('SELECT solarSystemName, solarSystemID '
                    'FROM mapsolarsystems;')
@@ -84,23 +206,56 @@ def write_table(conn, entries):
     for row in cursor:
         ids[row[0]] = row[1]
     f = lambda s: s or 0
+    rows = [(ids[s], s, d, ids[n], f(n)) for s, d, n in entries]
 
-    cursor.execute('CREATE TABLE rudsmapjitadistance ('
-                   ' solarSystemID INT(11) PRIMARY KEY, '
-                   ' solarSystemName VARCHAR(100), '
-                   ' distance INT(11), '
-                   ' nextSolarSystemID INT(11), '
-                   ' nextSolarSystemName VARCHAR(100));')
-    for s, d, n in entries:
-        cursor.execute('INSERT INTO rudsmapjitadistance '
-                       'VALUES (?, ?, ?, ?, ?);',
-                       (ids[s], s, d, ids[n], f(n)))
+    # Manage the transaction by hand, since the sqlite3 module would
+    # otherwise commit before each CREATE and DROP.
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        cursor.execute('BEGIN;')
+        if incremental and _table_exists(cursor, _TABLE):
+            rows, removed = _changed_rows(cursor, rows)
+            for batch in _batches((i,) for i in removed):
+                cursor.executemany('DELETE FROM %s WHERE solarSystemID = ?;'
+                                   % _TABLE, batch)
+            for batch in _batches(rows):
+                cursor.executemany('INSERT OR REPLACE INTO %s '
+                                   'VALUES (?, ?, ?, ?, ?);' % _TABLE, batch)
+            num_written = len(rows) + len(removed)
+        else:
+            _create_table(cursor)
+            for batch in _batches(rows):
+                cursor.executemany('INSERT INTO %s VALUES (?, ?, ?, ?, ?);'
+                                   % _TABLE, batch)
+            _create_indexes(cursor)
+            num_written = len(rows)
+        if fingerprint is not None:
+            cursor.execute('CREATE TABLE IF NOT EXISTS %s ('
+                           ' key VARCHAR(100) PRIMARY KEY, '
+                           ' value VARCHAR(100));' % _META_TABLE)
+            cursor.execute('INSERT OR REPLACE INTO %s VALUES (?, ?);'
+                           % _META_TABLE,
+                           ('mapjumps_fingerprint', fingerprint))
+        cursor.execute('COMMIT;')
+    except:
+        cursor.execute('ROLLBACK;')
+        raise
+    finally:
+        conn.isolation_level = isolation_level
+    return num_written
 
 def main(argv):
     flags = read_flags(argv)
     with sqlite3.connect(flags.dbfile) as conn:
-        write_table(conn, compute_distance(read_graph(conn)))
-        conn.commit()
+        tune_connection(conn)
+        fingerprint = mapjumps_fingerprint(conn)
+        if flags.incremental and read_fingerprint(conn) == fingerprint:
+            print 'The jump graph is unchanged; nothing to do.'
+            return
+        written = write_table(conn, compute_distance(read_graph(conn)),
+                              flags.incremental, fingerprint)
+        print 'Wrote %d rows.' % written
 
 if __name__ == '__main__':
     main(sys.argv)
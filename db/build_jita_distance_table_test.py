@@ -0,0 +1,72 @@
+#!/usr/bin/python
+
+"""Tests for the incremental update of the Jita distance table."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import build_jita_distance_table
+
+# Jita - Perimeter - Sobaseki, and Urlen with no gates yet.
+SYSTEMS = [(1, 'Jita'), (2, 'Perimeter'), (3, 'Sobaseki'), (4, 'Urlen')]
+# (stargate, solar system); each jump is between a pair of gates.
+GATES = [(11, 1), (12, 2), (13, 2), (14, 3)]
+JUMPS = [(11, 12), (12, 11), (13, 14), (14, 13)]
+
+def make_db(filename):
+    with sqlite3.connect(filename) as conn:
+        cursor = conn.cursor()
+        cursor.execute('CREATE TABLE mapsolarsystems '
+                       '(solarSystemID INT, solarSystemName TEXT);')
+        cursor.executemany('INSERT INTO mapsolarsystems VALUES (?, ?);',
+                           SYSTEMS)
+        cursor.execute('CREATE TABLE mapdenormalize '
+                       '(itemID INT, groupID INT, solarSystemID INT);')
+        cursor.executemany('INSERT INTO mapdenormalize VALUES (?, 10, ?);',
+                           GATES)
+        cursor.execute('CREATE TABLE mapjumps '
+                       '(stargateID INT, celestialID INT);')
+        cursor.executemany('INSERT INTO mapjumps VALUES (?, ?);', JUMPS)
+
+def move_gate(filename, gate, system):
+    """Move a stargate to another system, leaving mapjumps alone."""
+    with sqlite3.connect(filename) as conn:
+        conn.execute('UPDATE mapdenormalize SET solarSystemID = ? '
+                     'WHERE itemID = ?;', (system, gate))
+
+class IncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self.dir, 'eve.db')
+        make_db(self.dbfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def distances(self):
+        with sqlite3.connect(self.dbfile) as conn:
+            return dict(conn.execute('SELECT solarSystemName, distance '
+                                     'FROM rudsmapjitadistance;'))
+
+    def testFingerprintCoversGateLocations(self):
+        with sqlite3.connect(self.dbfile) as conn:
+            before = build_jita_distance_table.mapjumps_fingerprint(conn)
+        move_gate(self.dbfile, 14, 4)
+        with sqlite3.connect(self.dbfile) as conn:
+            after = build_jita_distance_table.mapjumps_fingerprint(conn)
+        self.assertNotEqual(before, after)
+
+    def testIncrementalAfterGateMoved(self):
+        build_jita_distance_table.main(['x', self.dbfile])
+        self.assertEqual({ 'Jita': 0, 'Perimeter': 1, 'Sobaseki': 2 },
+                         self.distances())
+        move_gate(self.dbfile, 14, 4)
+        build_jita_distance_table.main(['x', self.dbfile, '--incremental'])
+        self.assertEqual({ 'Jita': 0, 'Perimeter': 1, 'Urlen': 2 },
+                         self.distances())
+
+if __name__ == '__main__':
+    unittest.main()
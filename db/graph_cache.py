@@ -0,0 +1,256 @@
+#!/usr/bin/python
+
+"""Cache the jump graph in a compact file that loads in milliseconds.
+
+read_graph joins mapdenormalize with mapsolarsystems and scans
+mapjumps every time it runs. The graph cache holds the same graph in
+compressed sparse row form, laid out so it can be memory-mapped:
+
+    header        '<8sIIIqd40s': MAGIC, VERSION, number of systems n,
+                  number of neighbour entries m, the size and mtime of
+                  the database it was built from, and its
+                  mapjumps_fingerprint
+    system ids    n int32s
+    offsets       n + 1 int32s; the neighbours of system i are entries
+                  offsets[i] to offsets[i + 1] of the neighbours array
+    neighbours    m int32s, each the index of a system in the id table
+    names         the n system names, utf-8, separated by newlines
+
+Systems are numbered in order of solarSystemID, as in the jump distance
+matrix. All values are little endian.
+
+load_graph keeps the cache up to date: if the database's size or mtime
+has changed since the cache was built, the jump graph is fingerprinted
+again and the cache is rebuilt if the graph changed.
+"""
+
+import argparse
+import array
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+
+import build_jita_distance_table
+import jump_distance_matrix
+
+MAGIC = 'EVEGRAPH'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sIIIqd40s')
+
+def read_flags(argv):
+    parser = argparse.ArgumentParser(
+        prog=argv[0],
+        description=('Build or refresh the cache of the jump graph '
+                     'for a static data dump.'))
+    parser.add_argument('dbfile', metavar='<dbfile>',
+                        help='The file containing the Eve static data dump.')
+    parser.add_argument('cachefile', metavar='<cachefile>', nargs='?',
+                        help='The cache file. Defaults to <dbfile>.graph.')
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild the cache even if it is up to date.')
+    return parser.parse_args(argv[1:])
+
+def default_cache_file(dbfile):
+    return dbfile + '.graph'
+
+def _source_stamp(dbfile):
+    """Return the (size, mtime) of dbfile."""
+    st = os.stat(dbfile)
+    return st.st_size, st.st_mtime
+
+def _int32s(values):
+    a = array.array('i', values)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a.tostring()
+
+def write_graph(filename, systems, neighbours, fingerprint,
+                source_stamp=(0, 0.0)):
+    """Write the graph cache to filename.
+
+    The file is written under a temporary name and then renamed, so a
+    reader never sees a partial cache.
+
+    Args:
+        filename: The file to write.
+        systems: A list of (solarSystemID, solarSystemName) pairs, as
+            from read_systems.
+        neighbours: The graph over systems, as from index_graph.
+        fingerprint: The mapjumps_fingerprint of the database.
+        source_stamp: The (size, mtime) of the database file.
+    """
+    offsets = [0]
+    for adjacent in neighbours:
+        offsets.append(offsets[-1] + len(adjacent))
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'wb') as out:
+        out.write(_HEADER.pack(MAGIC, VERSION, len(systems), offsets[-1],
+                               source_stamp[0], source_stamp[1],
+                               fingerprint))
+        out.write(_int32s(s[0] for s in systems))
+        out.write(_int32s(offsets))
+        out.write(_int32s(v for adjacent in neighbours for v in adjacent))
+        out.write('\n'.join(s[1] for s in systems).encode('utf-8'))
+    os.rename(tmpname, filename)
+
+def build_graph(conn, filename, source_stamp=(0, 0.0), fingerprint=None):
+    """Read the jump graph from conn and write it to filename."""
+    if fingerprint is None:
+        fingerprint = build_jita_distance_table.mapjumps_fingerprint(conn)
+    systems = jump_distance_matrix.read_systems(conn)
+    adjacency = build_jita_distance_table.read_graph(conn)
+    neighbours = jump_distance_matrix.index_graph(
+        adjacency, [s[1] for s in systems])
+    write_graph(filename, systems, neighbours, fingerprint, source_stamp)
+
+class JumpGraph(object):
+    """A memory-mapped graph cache, as written by write_graph.
+
+    Opening the file reads only the header and the system table; the
+    offsets and neighbours are read from the map as they are needed.
+    """
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, n, m, size, mtime,
+         fingerprint) = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError('%s is not a jump graph cache.' % filename)
+        if version != VERSION:
+            self._map.close()
+            raise ValueError('%s has version %d, not %d.'
+                             % (filename, version, VERSION))
+        self._n = n
+        self._m = m
+        self._source_stamp = (size, mtime)
+        self._fingerprint = fingerprint
+        self._ids = struct.unpack_from('<%di' % n, self._map, _HEADER.size)
+        self._offsets_offset = _HEADER.size + 4 * n
+        self._neighbours_offset = self._offsets_offset + 4 * (n + 1)
+        names_offset = self._neighbours_offset + 4 * m
+        self._names = self._map[names_offset:].decode('utf-8').split('\n')
+        self._index = None
+
+    def close(self):
+        self._map.close()
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def names(self):
+        """The system names, in index order."""
+        return self._names
+
+    @property
+    def ids(self):
+        """The solarSystemIDs, in index order."""
+        return self._ids
+
+    @property
+    def fingerprint(self):
+        """The mapjumps_fingerprint of the database the cache is of."""
+        return self._fingerprint
+
+    @property
+    def source_stamp(self):
+        """The (size, mtime) of the database the cache is of."""
+        return self._source_stamp
+
+    def index(self, system):
+        """Return the index of a system given by name or id."""
+        if self._index is None:
+            self._index = dict((name, i) for i, name in enumerate(self._names))
+            self._index.update((system_id, i)
+                               for i, system_id in enumerate(self._ids))
+        try:
+            return self._index[system]
+        except KeyError:
+            raise KeyError('Unknown solar system %r.' % (system,))
+
+    def neighbours(self, i):
+        """Return the indexes of the systems adjacent to system i."""
+        start, end = struct.unpack_from(
+            '<2i', self._map, self._offsets_offset + 4 * i)
+        return list(struct.unpack_from(
+            '<%di' % (end - start), self._map,
+            self._neighbours_offset + 4 * start))
+
+    def index_lists(self):
+        """Return the whole graph as lists of indexes, like index_graph."""
+        offsets = struct.unpack_from('<%di' % (self._n + 1), self._map,
+                                     self._offsets_offset)
+        flat = struct.unpack_from('<%di' % self._m, self._map,
+                                  self._neighbours_offset)
+        return [list(flat[offsets[i]:offsets[i + 1]])
+                for i in xrange(self._n)]
+
+    def adjacency(self):
+        """Return the graph as a map of names, like read_graph."""
+        names = self._names
+        return dict((names[i], [names[v] for v in adjacent])
+                    for i, adjacent in enumerate(self.index_lists())
+                    if adjacent)
+
+def load_graph(dbfile, cachefile=None, force=False):
+    """Open the graph cache for dbfile, building it if it is stale.
+
+    The cache is fresh if dbfile's size and mtime are those it was
+    built from. Otherwise the database is fingerprinted; if the jump
+    graph is the same, only the cache's stamp is updated, and if not,
+    the cache is rebuilt.
+
+    Args:
+        dbfile: The file containing the Eve static data dump.
+        cachefile: The cache file. Defaults to default_cache_file(dbfile).
+        force: Whether to rebuild the cache even if it is fresh.
+
+    Returns:
+        A JumpGraph.
+    """
+    if cachefile is None:
+        cachefile = default_cache_file(dbfile)
+    stamp = _source_stamp(dbfile)
+    graph = None
+    if not force:
+        try:
+            graph = JumpGraph(cachefile)
+        except (IOError, OSError, ValueError, struct.error):
+            graph = None
+        if graph is not None and graph.source_stamp == stamp:
+            return graph
+
+    with sqlite3.connect(dbfile) as conn:
+        fingerprint = build_jita_distance_table.mapjumps_fingerprint(conn)
+        if graph is not None and graph.fingerprint == fingerprint:
+            # Only the stamp changed. Copy the cache with the new header
+            # and rename it over the old one, as write_graph does, since
+            # other processes may have the cache mapped.
+            body = graph._map[_HEADER.size:]
+            graph.close()
+            tmpname = cachefile + '.tmp'
+            with open(tmpname, 'wb') as out:
+                out.write(_HEADER.pack(MAGIC, VERSION, len(graph), graph._m,
+                                       stamp[0], stamp[1], fingerprint))
+                out.write(body)
+            os.rename(tmpname, cachefile)
+        else:
+            if graph is not None:
+                graph.close()
+            build_graph(conn, cachefile, stamp, fingerprint)
+    return JumpGraph(cachefile)
+
+def main(argv):
+    flags = read_flags(argv)
+    cachefile = flags.cachefile or default_cache_file(flags.dbfile)
+    graph = load_graph(flags.dbfile, cachefile, flags.force)
+    print 'Cached %d systems and %d jumps in %s.' % (
+        len(graph), graph._m, cachefile)
+    graph.close()
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+
+"""Tests that load_graph keeps the graph cache up to date."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import build_jita_distance_table
+import build_jita_distance_table_test
+import graph_cache
+
+def sorted_adjacency(adjacency):
+    return dict((name, sorted(adjacent))
+                for name, adjacent in adjacency.iteritems())
+
+class LoadGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self.dir, 'eve.db')
+        build_jita_distance_table_test.make_db(self.dbfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def adjacency(self):
+        graph = graph_cache.load_graph(self.dbfile)
+        try:
+            return sorted_adjacency(graph.adjacency())
+        finally:
+            graph.close()
+
+    def touch(self):
+        """Change the database's mtime without changing its contents."""
+        st = os.stat(self.dbfile)
+        os.utime(self.dbfile, (st.st_atime, st.st_mtime + 10))
+
+    def testRestamp(self):
+        expected = self.adjacency()
+        old = graph_cache.load_graph(self.dbfile)
+        self.touch()
+        self.assertEqual(expected, self.adjacency())
+        # The old map still reads the cache it was opened on.
+        self.assertEqual(expected, sorted_adjacency(old.adjacency()))
+        old.close()
+        graph = graph_cache.load_graph(self.dbfile)
+        self.assertEqual(graph_cache._source_stamp(self.dbfile),
+                         graph.source_stamp)
+        graph.close()
+        self.assertFalse(os.path.exists(
+            graph_cache.default_cache_file(self.dbfile) + '.tmp'))
+
+    def testGateMoved(self):
+        self.assertEqual(['Perimeter'], self.adjacency()['Jita'])
+        build_jita_distance_table_test.move_gate(self.dbfile, 11, 4)
+        self.touch()
+        with sqlite3.connect(self.dbfile) as conn:
+            expected = build_jita_distance_table.read_graph(conn)
+        self.assertEqual(sorted_adjacency(expected), self.adjacency())
+        self.assertFalse('Jita' in self.adjacency())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,288 @@
+#!/usr/bin/python
+
+"""Build and read a matrix of jump distances between all solar systems.
+
+The matrix file holds, for every pair of solar systems, the number of
+jumps between them and the next system to travel to on a shortest
+route. It is laid out so that it can be memory-mapped and queried
+without being loaded:
+
+    header        '<8sII': MAGIC, VERSION, number of systems n
+    system ids    n int32s
+    distances     n * n uint8s; row i holds the jumps from system i,
+                  UNREACHABLE if there is no route
+    next hops     n * n uint16s; row i holds the index of the next
+                  system on a route from system i, NO_HOP if none
+    names         the n system names, utf-8, separated by newlines
+
+Systems are numbered in order of solarSystemID. All values are little
+endian.
+"""
+
+import argparse
+import array
+import mmap
+import multiprocessing
+import os
+import sqlite3
+import struct
+import sys
+
+import build_jita_distance_table
+
+MAGIC = 'EVEJUMPS'
+VERSION = 1
+UNREACHABLE = 255
+NO_HOP = 0xFFFF
+
+_HEADER = struct.Struct('<8sII')
+
+def read_flags(argv):
+    parser = argparse.ArgumentParser(
+        prog=argv[0],
+        description=('Build a file holding the number of jumps between '
+                     'every pair of solar systems.'))
+    parser.add_argument('dbfile', metavar='<dbfile>',
+                        help='The file containing the Eve static data dump.')
+    parser.add_argument('outfile', metavar='<outfile>',
+                        help='The matrix file to write.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='The number of worker processes.')
+    return parser.parse_args(argv[1:])
+
+def read_systems(conn):
+    """Read the id and name of every solar system, in id order.
+
+    Returns:
+        A list of (solarSystemID, solarSystemName) pairs.
+    """
+    cursor = conn.cursor()
+    cursor.execute('SELECT solarSystemID, solarSystemName '
+                   'FROM mapsolarsystems ORDER BY solarSystemID;')
+    return [(row[0], row[1]) for row in cursor]
+
+def index_graph(adjacency, names):
+    """Convert adjacency, as from read_graph, to lists of indexes.
+
+    Args:
+        adjacency: A map from solar system name to a list of adjacent
+            solar system names.
+        names: The list of all solar system names.
+
+    Returns:
+        A list holding, for each system in names, a sorted list of the
+        indexes in names of the adjacent systems.
+    """
+    index = dict((name, i) for i, name in enumerate(names))
+    neighbours = [[] for name in names]
+    for system, adjacent in adjacency.iteritems():
+        neighbours[index[system]] = sorted(set(index[v] for v in adjacent))
+    return neighbours
+
+def bfs(neighbours, source):
+    """Find the shortest routes from source by breadth first search.
+
+    Args:
+        neighbours: A list of lists of adjacent indexes, as from
+            index_graph.
+        source: The index of the starting system.
+
+    Returns:
+        A pair (distance, first), lists holding for each system the
+        number of jumps from source, or None if it can't be reached,
+        and the index of the first system after source on a shortest
+        route to it, or None.
+    """
+    n = len(neighbours)
+    distance = [None] * n
+    first = [None] * n
+    distance[source] = 0
+    frontier = []
+    for v in neighbours[source]:
+        if distance[v] is None:
+            distance[v] = 1
+            first[v] = v
+            frontier.append(v)
+    d = 1
+    while frontier:
+        d += 1
+        next_frontier = []
+        for u in frontier:
+            hop = first[u]
+            for v in neighbours[u]:
+                if distance[v] is None:
+                    distance[v] = d
+                    first[v] = hop
+                    next_frontier.append(v)
+        frontier = next_frontier
+    return distance, first
+
+def _matrix_rows(neighbours, source):
+    """Return the distance and next hop rows of source as strings."""
+    distance, first = bfs(neighbours, source)
+    if max(distance) >= UNREACHABLE:
+        raise ValueError('A route from system %d is too long to store.'
+                         % source)
+    distances = array.array(
+        'B', [UNREACHABLE if d is None else d for d in distance])
+    hops = array.array('H', [NO_HOP if h is None else h for h in first])
+    if sys.byteorder != 'little':
+        hops.byteswap()
+    return distances.tostring(), hops.tostring()
+
+_worker_neighbours = None
+
+def _init_worker(neighbours):
+    global _worker_neighbours
+    _worker_neighbours = neighbours
+
+def _worker_rows(sources):
+    return [(s,) + _matrix_rows(_worker_neighbours, s) for s in sources]
+
+def write_matrix(filename, systems, neighbours, jobs=1, chunk_size=64):
+    """Compute the matrix and write it to filename.
+
+    The file is written under a temporary name and then renamed, so a
+    reader never sees a partial matrix.
+
+    Args:
+        filename: The file to write.
+        systems: A list of (solarSystemID, solarSystemName) pairs, as
+            from read_systems.
+        neighbours: The graph over systems, as from index_graph.
+        jobs: The number of worker processes to run BFS in.
+        chunk_size: The number of sources each worker task handles.
+    """
+    n = len(systems)
+    if n >= NO_HOP:
+        raise ValueError('Too many systems: %d.' % n)
+    ids = array.array('i', [s[0] for s in systems])
+    if sys.byteorder != 'little':
+        ids.byteswap()
+    distance_offset = _HEADER.size + 4 * n
+    hop_offset = distance_offset + n * n
+
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'wb') as out:
+        out.write(_HEADER.pack(MAGIC, VERSION, n))
+        out.write(ids.tostring())
+        out.truncate(hop_offset + 2 * n * n)
+        out.seek(hop_offset + 2 * n * n)
+        out.write('\n'.join(s[1] for s in systems).encode('utf-8'))
+
+        chunks = [range(i, min(i + chunk_size, n))
+                  for i in xrange(0, n, chunk_size)]
+        if jobs > 1:
+            pool = multiprocessing.Pool(jobs, _init_worker, (neighbours,))
+            results = pool.imap_unordered(_worker_rows, chunks)
+        else:
+            pool = None
+            _init_worker(neighbours)
+            results = (_worker_rows(chunk) for chunk in chunks)
+        try:
+            for rows in results:
+                for source, distances, hops in rows:
+                    out.seek(distance_offset + source * n)
+                    out.write(distances)
+                    out.seek(hop_offset + 2 * source * n)
+                    out.write(hops)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    os.rename(tmpname, filename)
+
+class JumpDistanceMatrix(object):
+    """A memory-mapped matrix file, as written by write_matrix.
+
+    Opening the file reads only the header and the system table. Each
+    query reads a few bytes of the mapped matrix.
+    """
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a jump distance matrix.' % filename)
+        if version != VERSION:
+            raise ValueError('%s has version %d, not %d.'
+                             % (filename, version, VERSION))
+        self._n = n
+        self._ids = struct.unpack_from('<%di' % n, self._map, _HEADER.size)
+        self._distance_offset = _HEADER.size + 4 * n
+        self._hop_offset = self._distance_offset + n * n
+        names_offset = self._hop_offset + 2 * n * n
+        self._names = self._map[names_offset:].decode('utf-8').split('\n')
+        self._index = dict((name, i) for i, name in enumerate(self._names))
+        self._index.update((system_id, i)
+                           for i, system_id in enumerate(self._ids))
+
+    def close(self):
+        self._map.close()
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def names(self):
+        """The system names, in matrix order."""
+        return self._names
+
+    @property
+    def ids(self):
+        """The solarSystemIDs, in matrix order."""
+        return self._ids
+
+    def index(self, system):
+        """Return the matrix index of a system given by name or id."""
+        try:
+            return self._index[system]
+        except KeyError:
+            raise KeyError('Unknown solar system %r.' % (system,))
+
+    def distance(self, start, end):
+        """The number of jumps from start to end, or None if unreachable.
+
+        start and end are system names or ids.
+        """
+        i = self.index(start)
+        j = self.index(end)
+        d = ord(self._map[self._distance_offset + i * self._n + j])
+        if d == UNREACHABLE:
+            return None
+        return d
+
+    def next_hop(self, start, end):
+        """The name of the next system from start towards end, or None."""
+        i = self.index(start)
+        j = self.index(end)
+        offset = self._hop_offset + 2 * (i * self._n + j)
+        hop = struct.unpack_from('<H', self._map, offset)[0]
+        if hop == NO_HOP:
+            return None
+        return self._names[hop]
+
+    def route(self, start, end):
+        """Return a shortest route from start to end as a list of names.
+
+        The route includes both ends. Returns None if end is unreachable.
+        """
+        if self.distance(start, end) is None:
+            return None
+        end = self._names[self.index(end)]
+        route = [self._names[self.index(start)]]
+        while route[-1] != end:
+            route.append(self.next_hop(route[-1], end))
+        return route
+
+def main(argv):
+    flags = read_flags(argv)
+    with sqlite3.connect(flags.dbfile) as conn:
+        systems = read_systems(conn)
+        adjacency = build_jita_distance_table.read_graph(conn)
+    neighbours = index_graph(adjacency, [s[1] for s in systems])
+    write_matrix(flags.outfile, systems, neighbours, flags.jobs)
+
+if __name__ == '__main__':
+    main(sys.argv)
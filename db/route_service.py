@@ -0,0 +1,225 @@
+#!/usr/bin/python
+
+"""Answer shortest-route queries between solar systems.
+
+The jump graph is read from the static data dump once, and each query
+is answered in memory with a bidirectional breadth first search. Routes
+can avoid a list of systems or systems below a security level, and
+recent routes are cached.
+
+Run as a program, this reads queries from standard input, one per
+line, and prints each route:
+
+    $ echo 'Jita Amarr' | ./route_service.py eve.db --min-security 0.45
+"""
+
+import argparse
+import collections
+import sqlite3
+import sys
+
+import build_jita_distance_table
+import graph_cache
+import jump_distance_matrix
+
+def read_flags(argv):
+    parser = argparse.ArgumentParser(
+        prog=argv[0],
+        description=('Read pairs of solar systems from standard input and '
+                     'print the shortest route between each.'))
+    parser.add_argument('dbfile', metavar='<dbfile>',
+                        help='The file containing the Eve static data dump.')
+    parser.add_argument('--min-security', type=float, default=None,
+                        help='Avoid systems with a lower security status.')
+    parser.add_argument('--avoid', action='append', default=[],
+                        metavar='<system>', help='A system to avoid.')
+    return parser.parse_args(argv[1:])
+
+def read_security(conn):
+    """Read the security status of each solar system.
+
+    Returns:
+        A map from solar system name to security status.
+    """
+    cursor = conn.cursor()
+    cursor.execute('SELECT solarSystemName, security FROM mapsolarsystems;')
+    return dict((row[0], row[1]) for row in cursor)
+
+class RouteService(object):
+    """Finds shortest routes in a jump graph, caching recent results."""
+    def __init__(self, adjacency, security=None, cache_size=10000):
+        """Initialize a RouteService.
+
+        Args:
+            adjacency: A map from solar system name to a list of
+                adjacent solar system names, as from read_graph.
+            security: A map from solar system name to security status.
+                Systems without one are taken to have security 1.0.
+            cache_size: The number of routes to cache.
+        """
+        names = sorted(set(adjacency).union(*adjacency.itervalues()))
+        self._names = names
+        self._index = dict((name, i) for i, name in enumerate(names))
+        self._neighbours = jump_distance_matrix.index_graph(adjacency, names)
+        security = security or {}
+        self._security = [security.get(name, 1.0) for name in names]
+        self._cache_size = cache_size
+        # key = (start, end, min_security, avoid), value = route or None
+        self._cache = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    @classmethod
+    def from_db(cls, conn, cache_size=10000):
+        """Build a RouteService from the static data dump in conn."""
+        return cls(build_jita_distance_table.read_graph(conn),
+                   read_security(conn), cache_size)
+
+    @property
+    def hits(self):
+        """The number of routes answered from the cache."""
+        return self._hits
+
+    @property
+    def misses(self):
+        """The number of routes that had to be searched for."""
+        return self._misses
+
+    def route(self, start, end, min_security=None, avoid=()):
+        """Find a shortest route from start to end.
+
+        Args:
+            start, end: Solar system names.
+            min_security: If given, avoid systems with a lower security
+                status. start and end are always allowed.
+            avoid: Solar system names to avoid. start and end are always
+                allowed.
+
+        Returns:
+            A list of system names from start to end inclusive, or None
+            if there is no route.
+
+        Raises:
+            KeyError: If start or end is not in the jump graph.
+        """
+        # Jumps go both ways, so a route and its reverse share an entry.
+        reverse = end < start
+        if reverse:
+            start, end = end, start
+        key = (start, end, min_security, frozenset(avoid))
+        try:
+            route = self._cache.pop(key)
+            self._hits += 1
+        except KeyError:
+            self._misses += 1
+            route = self._search(start, end, min_security, key[3])
+            if self._cache and len(self._cache) >= self._cache_size:
+                self._cache.popitem(last=False)
+        if self._cache_size > 0:
+            self._cache[key] = route
+        if route is None:
+            return None
+        if reverse:
+            return list(reversed(route))
+        return list(route)
+
+    def jumps(self, start, end, min_security=None, avoid=()):
+        """The number of jumps from start to end, or None if unreachable."""
+        route = self.route(start, end, min_security, avoid)
+        if route is None:
+            return None
+        return len(route) - 1
+
+    def _search(self, start, end, min_security, avoid):
+        """Search for a route with a bidirectional breadth first search.
+
+        Returns:
+            A tuple of system names, or None.
+        """
+        index = self._index
+        try:
+            s = index[start]
+            t = index[end]
+        except KeyError, e:
+            raise KeyError('Unknown solar system %s.' % e)
+        if s == t:
+            return (start,)
+        neighbours = self._neighbours
+        security = self._security
+        blocked = set(index[name] for name in avoid if name in index)
+
+        # parents[side] maps each system reached from that side to the
+        # system it was reached from. Each system is checked against the
+        # other side as it is reached, so the first system reached from
+        # both sides is on a shortest route.
+        parents = ({ s: None }, { t: None })
+        frontiers = ([s], [t])
+        meeting = None
+        while meeting is None and frontiers[0] and frontiers[1]:
+            # Grow the smaller frontier by one level.
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            parent = parents[side]
+            other = parents[1 - side]
+            next_frontier = []
+            for u in frontiers[side]:
+                for v in neighbours[u]:
+                    if v in parent:
+                        continue
+                    if v in other:
+                        # Systems reached from the other side have
+                        # already passed the filters.
+                        parent[v] = u
+                        meeting = v
+                        break
+                    if v in blocked or (min_security is not None
+                                        and security[v] < min_security):
+                        continue
+                    parent[v] = u
+                    next_frontier.append(v)
+                if meeting is not None:
+                    break
+            frontiers[side][:] = next_frontier
+        if meeting is None:
+            return None
+
+        names = self._names
+        route = []
+        v = meeting
+        while v is not None:
+            route.append(names[v])
+            v = parents[0][v]
+        route.reverse()
+        v = parents[1][meeting]
+        while v is not None:
+            route.append(names[v])
+            v = parents[1][v]
+        return tuple(route)
+
+def main(argv):
+    flags = read_flags(argv)
+    graph = graph_cache.load_graph(flags.dbfile)
+    with sqlite3.connect(flags.dbfile) as conn:
+        security = read_security(conn)
+    service = RouteService(graph.adjacency(), security)
+    graph.close()
+    for line in sys.stdin:
+        systems = line.split()
+        if not systems:
+            continue
+        if len(systems) != 2:
+            print >>sys.stderr, 'Expected two systems: %s' % line.strip()
+            continue
+        try:
+            route = service.route(systems[0], systems[1],
+                                  flags.min_security, flags.avoid)
+        except KeyError, e:
+            print >>sys.stderr, e.args[0]
+            continue
+        if route is None:
+            print 'No route from %s to %s.' % tuple(systems)
+        else:
+            print '%d jumps: %s' % (len(route) - 1, ' '.join(route))
+        sys.stdout.flush()
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,251 @@
+#!/usr/bin/python
+
+"""Find solar systems by straight-line distance, for jump drives.
+
+SpatialIndex puts each system's coordinates, in light-years, in a
+uniform grid, so that the systems within a radius of a point, or the k
+nearest to it, can be found by looking at a few cells rather than at
+every system. jump_graph uses it to build the graph of jumps a ship
+with a given jump range can make, in the same form as read_graph, so
+it can be searched by RouteService or index_graph and bfs, like the
+stargate graph:
+
+    $ ./spatial_index.py eve.db Jita --radius 5
+    $ ./spatial_index.py eve.db Jita --nearest 10
+    $ ./spatial_index.py eve.db Jita --jump-range 7 --to Amarr
+"""
+
+import argparse
+import math
+import sqlite3
+import sys
+
+import route_service
+
+# Meters per light-year; the static data gives coordinates in meters.
+LIGHT_YEAR = 9460730472580800.0
+
+def read_flags(argv):
+    parser = argparse.ArgumentParser(
+        prog=argv[0],
+        description=('Find the solar systems near a system, or a jump '
+                     'drive route from it.'))
+    parser.add_argument('dbfile', metavar='<dbfile>',
+                        help='The file containing the Eve static data dump.')
+    parser.add_argument('system', metavar='<system>',
+                        help='The solar system to start from.')
+    parser.add_argument('--radius', type=float,
+                        help='List the systems within this many light-years.')
+    parser.add_argument('--nearest', type=int,
+                        help='List this many of the nearest systems.')
+    parser.add_argument('--jump-range', type=float,
+                        help='The jump range, in light-years, for --to.')
+    parser.add_argument('--to', metavar='<system>',
+                        help='Print a jump drive route to this system.')
+    return parser.parse_args(argv[1:])
+
+def read_coordinates(conn):
+    """Read the position of every solar system, in id order.
+
+    Returns:
+        A list of (solarSystemID, solarSystemName, x, y, z), with the
+        coordinates in light-years.
+    """
+    cursor = conn.cursor()
+    cursor.execute('SELECT solarSystemID, solarSystemName, x, y, z '
+                   'FROM mapsolarsystems ORDER BY solarSystemID;')
+    return [(row[0], row[1], row[2] / LIGHT_YEAR, row[3] / LIGHT_YEAR,
+             row[4] / LIGHT_YEAR) for row in cursor]
+
+class SpatialIndex(object):
+    """A uniform grid over solar system coordinates."""
+    def __init__(self, systems, cell_size=5.0):
+        """Initialize a SpatialIndex.
+
+        Args:
+            systems: A list of (solarSystemID, solarSystemName, x, y, z),
+                as from read_coordinates.
+            cell_size: The edge of a grid cell, in light-years. Queries
+                are fastest when it is near the usual query radius.
+        """
+        self._names = [s[1] for s in systems]
+        self._points = [s[2:5] for s in systems]
+        self._index = dict((name, i) for i, name in enumerate(self._names))
+        self._index.update((s[0], i) for i, s in enumerate(systems))
+        self._cell_size = cell_size
+        # key = cell (i, j, k), value = [indexes of the systems in it]
+        self._cells = {}
+        for i, point in enumerate(self._points):
+            self._cells.setdefault(self._cell(point), []).append(i)
+        if self._cells:
+            self._max_ring = max(
+                max(cell[d] for cell in self._cells) -
+                min(cell[d] for cell in self._cells) for d in xrange(3))
+        else:
+            self._max_ring = 0
+
+    def __len__(self):
+        return len(self._names)
+
+    @property
+    def names(self):
+        """The system names, in index order."""
+        return self._names
+
+    def index(self, system):
+        """Return the index of a system given by name or id."""
+        try:
+            return self._index[system]
+        except KeyError:
+            raise KeyError('Unknown solar system %r.' % (system,))
+
+    def position(self, system):
+        """Return the (x, y, z) of a system in light-years."""
+        return self._points[self.index(system)]
+
+    def distance(self, start, end):
+        """The distance between two systems in light-years."""
+        return _distance(self.position(start), self.position(end))
+
+    def _cell(self, point):
+        size = self._cell_size
+        return (int(math.floor(point[0] / size)),
+                int(math.floor(point[1] / size)),
+                int(math.floor(point[2] / size)))
+
+    def _ring(self, center, r):
+        """Yield the occupied cells at Chebyshev distance r from center."""
+        cells = self._cells
+        ci, cj, ck = center
+        for i in xrange(ci - r, ci + r + 1):
+            edge_i = i == ci - r or i == ci + r
+            for j in xrange(cj - r, cj + r + 1):
+                edge_j = edge_i or j == cj - r or j == cj + r
+                if edge_j:
+                    ks = xrange(ck - r, ck + r + 1)
+                else:
+                    ks = (ck - r, ck + r) if r else (ck,)
+                for k in ks:
+                    members = cells.get((i, j, k))
+                    if members is not None:
+                        yield members
+
+    def indexes_within(self, point, radius):
+        """Return the indexes of the systems within radius of point.
+
+        Returns:
+            A list of pairs (distance, index), sorted by distance.
+        """
+        points = self._points
+        x, y, z = point
+        r2 = radius * radius
+        reach = int(math.ceil(radius / self._cell_size))
+        center = self._cell(point)
+        found = []
+        for r in xrange(reach + 1):
+            for members in self._ring(center, r):
+                for i in members:
+                    px, py, pz = points[i]
+                    d2 = (px - x) ** 2 + (py - y) ** 2 + (pz - z) ** 2
+                    if d2 <= r2:
+                        found.append((math.sqrt(d2), i))
+        found.sort()
+        return found
+
+    def within(self, system, radius):
+        """Return the systems within radius light-years of system.
+
+        Returns:
+            A list of (name, distance) pairs, nearest first, not
+            including system itself.
+        """
+        i = self.index(system)
+        return [(self._names[j], d)
+                for d, j in self.indexes_within(self._points[i], radius)
+                if j != i]
+
+    def nearest(self, system, k):
+        """Return the k systems nearest to system.
+
+        Returns:
+            A list of (name, distance) pairs, nearest first, not
+            including system itself. It is empty if k is not positive.
+        """
+        i = self.index(system)
+        if k <= 0:
+            return []
+        point = self._points[i]
+        points = self._points
+        center = self._cell(point)
+        found = []
+        for r in xrange(self._max_ring + 1):
+            for members in self._ring(center, r):
+                for j in members:
+                    if j != i:
+                        found.append((_distance(point, points[j]), j))
+            # Every system not yet seen is at least r cells away.
+            found.sort()
+            if len(found) >= k and found[k - 1][0] <= r * self._cell_size:
+                break
+        return [(self._names[j], d) for d, j in found[:k]]
+
+def _distance(a, b):
+    return math.sqrt((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 +
+                     (a[2] - b[2]) ** 2)
+
+def jump_graph(index, jump_range, systems=None):
+    """Build the graph of jumps within jump_range light-years.
+
+    Args:
+        index: A SpatialIndex.
+        jump_range: The jump range, in light-years.
+        systems: If given, the names of the systems that may be jumped
+            to or from, e.g. those outside high security space.
+
+    Returns:
+        A map from solar system name to a list of the systems in range,
+        like read_graph. Systems with nothing in range are left out.
+    """
+    names = index.names
+    allowed = None if systems is None else set(index.index(s)
+                                               for s in systems)
+    adjacency = {}
+    for i, name in enumerate(names):
+        if allowed is not None and i not in allowed:
+            continue
+        adjacent = [names[j] for d, j
+                    in index.indexes_within(index.position(name), jump_range)
+                    if j != i and (allowed is None or j in allowed)]
+        if adjacent:
+            adjacency[name] = adjacent
+    return adjacency
+
+def main(argv):
+    flags = read_flags(argv)
+    with sqlite3.connect(flags.dbfile) as conn:
+        systems = read_coordinates(conn)
+    index = SpatialIndex(systems, flags.jump_range or flags.radius or 5.0)
+    if flags.radius is not None:
+        for name, d in index.within(flags.system, flags.radius):
+            print '%-20s %6.2f ly' % (name, d)
+    if flags.nearest is not None:
+        for name, d in index.nearest(flags.system, flags.nearest):
+            print '%-20s %6.2f ly' % (name, d)
+    if flags.to is not None:
+        if flags.jump_range is None:
+            print >>sys.stderr, '--to needs --jump-range.'
+            return 1
+        service = route_service.RouteService(
+            jump_graph(index, flags.jump_range))
+        try:
+            route = service.route(flags.system, flags.to)
+        except KeyError:
+            route = None
+        if route is None:
+            print 'No jump route from %s to %s.' % (flags.system, flags.to)
+        else:
+            print '%d jumps: %s' % (len(route) - 1, ' '.join(route))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
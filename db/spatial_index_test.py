@@ -0,0 +1,45 @@
+#!/usr/bin/python
+
+"""Compare SpatialIndex queries against a brute force search."""
+
+import random
+import unittest
+
+import spatial_index
+
+class SpatialIndexTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(1)
+        self.systems = [(30000000 + i, 'S%d' % i, rng.uniform(-40, 40),
+                         rng.uniform(-10, 10), rng.uniform(-40, 40))
+                        for i in xrange(500)]
+        self.index = spatial_index.SpatialIndex(self.systems, cell_size=4.0)
+
+    def brute_force(self, system):
+        """Return (distance, name) for every other system, nearest first."""
+        point = self.index.position(system)
+        return sorted((spatial_index._distance(point, s[2:5]), s[1])
+                      for s in self.systems if s[1] != system)
+
+    def testWithin(self):
+        for system in ('S0', 'S17', 'S250'):
+            expected = self.brute_force(system)
+            for radius in (0.0, 3.0, 4.0, 11.5, 200.0):
+                self.assertEqual(
+                    [(name, d) for d, name in expected if d <= radius],
+                    self.index.within(system, radius))
+
+    def testNearest(self):
+        for system in ('S0', 'S17', 'S250'):
+            expected = self.brute_force(system)
+            for k in (-1, 0, 1, 5, 50, 499, 600):
+                self.assertEqual(
+                    [(name, d) for d, name in expected[:max(k, 0)]],
+                    self.index.nearest(system, k))
+
+    def testById(self):
+        self.assertEqual(self.index.nearest('S3', 3),
+                         self.index.nearest(30000003, 3))
+
+if __name__ == '__main__':
+    unittest.main()
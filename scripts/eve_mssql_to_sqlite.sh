@@ -11,6 +11,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+# Superseded by eve_sql_to_sqlite.py, which is faster and can import
+# only selected tables.
+#
 # Read some SQL from sqlfile... and commit it to dbfile, an sqlite3
 # database file. If no sqlfiles are given on the command line, read
 # from standard input.
@@ -0,0 +1,587 @@
+#!/usr/bin/python
+# Copyright 2010 Matt Rudary
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Import the SQL dump of the Eve static data into an sqlite3 database.
+
+This replaces eve_mssql_to_sqlite.sh and eve_mysql_to_sqlite.sh. It
+reads the MS-SQL or MySQL dump created by the developers of Eve Online
+as a stream, makes the same fixes to the SQL dialect that those
+scripts make, and imports only the tables asked for. It is nowhere near
+a general purpose SQL translator.
+
+The dump is split into statements as it is read, and the INSERT
+statements are parsed in worker processes while the main process
+writes the rows with executemany. Primary keys and other indexes are
+built once all the rows are loaded. Writes are neither synced nor
+journaled, so if the import fails the database should be thrown away.
+
+EXAMPLES:
+If you want to create a big db file that has all the tables from the
+Trinity 1.0 release, run
+$ tar -jOxf trinity_1.0_sql.zip | ./eve_sql_to_sqlite.py trinity.db
+
+If you've already decompressed the tarball, you can create a db of the
+map related data by running
+$ ./eve_sql_to_sqlite.py -t 'map*' trinity_map.db dbo_map*.sql
+
+"""
+
+import argparse
+import codecs
+import collections
+import fnmatch
+import io
+import itertools
+import multiprocessing
+import re
+import sqlite3
+import sys
+import time
+
+
+MSSQL = 'mssql'
+MYSQL = 'mysql'
+DIALECTS = (MSSQL, MYSQL)
+
+# The number of characters of INSERT statements in each parsing task.
+_CHUNK_SIZE = 1 << 20
+
+# The number of lines read to guess the dialect of a dump.
+_PROBE_LINES = 200
+
+# Lines outside any statement that the old scripts dropped.
+_SKIP_LINE_RE = re.compile(r'\s*(?:--|(?:BEGIN|COMMIT|GO)\b)', re.I)
+
+# MySQL backslash escapes, which are removed before counting quotes.
+_MYSQL_ESCAPE_RE = re.compile(r'\\.', re.S)
+
+_NAME = r'([^\s(]+)'
+_CREATE_TABLE_RE = re.compile(
+    r'\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?' + _NAME +
+    r'\s*\((.*)\)[^)]*;\s*$', re.I | re.S)
+_CREATE_INDEX_RE = re.compile(
+    r'\s*CREATE\s+(UNIQUE\s+)?(?:(?:NON)?CLUSTERED\s+)?INDEX\s+' + _NAME +
+    r'\s+ON\s+' + _NAME + r'\s*\(([^)]*)\)', re.I)
+_INSERT_RE = re.compile(
+    r'\s*INSERT\s+INTO\s+' + _NAME + r'\s*(?:\(([^)]*)\)\s*)?VALUES\s*', re.I)
+
+# A key or index inside CREATE TABLE: kind, name and columns.
+_KEY_RE = re.compile(
+    r'(?:CONSTRAINT\s+\S+\s+)?(PRIMARY\s+KEY|UNIQUE(?:\s+(?:KEY|INDEX))?|'
+    r'KEY|INDEX)\s*(?:(?:NON)?CLUSTERED\s*)?([^\s(]+\s*)?\(([^)]*)\)\s*$',
+    re.I)
+
+_COLUMN_FIXES = {
+    MSSQL: [
+        (re.compile(r'\btrue\b', re.I), '1'),
+        (re.compile(r'\bfalse\b', re.I), '0'),
+        ],
+    MYSQL: [
+        (re.compile(r'\bint\b', re.I), 'integer'),
+        (re.compile(r'\s+(?:unsigned|auto_increment)\b', re.I), ''),
+        (re.compile(r'\s+(?:character\s+set|collate)\s+\w+', re.I), ''),
+        (re.compile(r"\s+comment\s+'(?:[^'\\]|\\.|'')*'", re.I), ''),
+        ],
+    }
+
+# One token of a VALUES list: punctuation, a quoted string or a bare
+# literal such as a number or NULL.
+_TOKEN_RES = {
+    MSSQL: re.compile(r"\s*(?:([(),;])|N?'((?:[^']|'')*)'|([^\s(),;']+))",
+                      re.S),
+    MYSQL: re.compile(r"\s*(?:([(),;])|N?'((?:[^'\\]|\\.|'')*)'|"
+                      r"([^\s(),;']+))", re.S),
+    }
+
+_MYSQL_STRING_ESCAPE_RE = re.compile(r"\\(.)|''", re.S)
+_MYSQL_ESCAPES = {
+    '0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a',
+    }
+
+_INT_RE = re.compile(r'[-+]?\d+$')
+
+
+def read_flags(argv):
+    parser = argparse.ArgumentParser(
+        prog=argv[0],
+        description=('Import the SQL dump of the Eve static data into an '
+                     'sqlite3 database.'))
+    parser.add_argument('dbfile', metavar='<dbfile>',
+                        help='The sqlite3 database file to write.')
+    parser.add_argument('sqlfiles', metavar='<sqlfile>', nargs='*',
+                        help='The SQL files to read. Defaults to standard '
+                        'input.')
+    parser.add_argument('-d', '--dialect', choices=DIALECTS,
+                        help='The SQL dialect of the dump. Guessed if not '
+                        'given.')
+    parser.add_argument('-t', '--table', dest='tables', action='append',
+                        metavar='<pattern>',
+                        help='A table to import, which may be a glob '
+                        "pattern such as 'map*'. Repeat for several. "
+                        'Defaults to every table.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='The number of worker processes.')
+    parser.add_argument('--encoding', default='utf-8-sig',
+                        help='The encoding of the dump.')
+    return parser.parse_args(argv[1:])
+
+
+def probe_dialect(lines):
+    """Guess the dialect of a dump from its first lines.
+
+    MySQL dumps quote names with backticks; MS-SQL dumps don't.
+
+    Args:
+      lines: An iterator over the lines of the dump. The sample is read
+          from it.
+
+    Returns:
+      A pair (dialect, lines), where lines iterates over all the lines,
+      including the sample.
+
+    """
+    sample = list(itertools.islice(lines, _PROBE_LINES))
+    dialect = MSSQL
+    for line in sample:
+        if '`' in line:
+            dialect = MYSQL
+            break
+    return dialect, itertools.chain(sample, lines)
+
+
+def statements(lines, dialect):
+    """Split a dump into statements.
+
+    A statement ends at a line ending in a semicolon outside any quoted
+    string. Comments, blank lines and transaction control between
+    statements are skipped.
+
+    Yields:
+      Each statement as a string.
+
+    """
+    parts = []
+    in_quote = False
+    for line in lines:
+        if not parts and (not line.strip() or _SKIP_LINE_RE.match(line)):
+            continue
+        parts.append(line)
+        text = line
+        if dialect == MYSQL and '\\' in text:
+            text = _MYSQL_ESCAPE_RE.sub('', text)
+        if text.count("'") % 2:
+            in_quote = not in_quote
+        if not in_quote and text.rstrip().endswith(';'):
+            yield ''.join(parts)
+            parts = []
+    if parts:
+        yield ''.join(parts)
+
+
+def _table_name(name):
+    """Remove quoting and the dbo. schema from a table or column name."""
+    name = name.strip().replace('`', '').replace('"', '')
+    name = name.replace('[', '').replace(']', '')
+    if name.lower().startswith('dbo.'):
+        name = name[4:]
+    return name
+
+
+def _column_names(columns):
+    return ', '.join(_table_name(c) for c in columns.split(','))
+
+
+def _split_top_level(body):
+    """Split the body of CREATE TABLE at commas outside parentheses."""
+    items = []
+    depth = 0
+    quote = False
+    start = 0
+    for i, c in enumerate(body):
+        if c == "'":
+            quote = not quote
+        elif quote:
+            continue
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            items.append(body[start:i])
+            start = i + 1
+    items.append(body[start:])
+    return [item.strip() for item in items if item.strip()]
+
+
+def _index_sql(name, table, columns, unique):
+    return 'CREATE %sINDEX %s ON %s (%s);' % (
+        'UNIQUE ' if unique else '', name, table, _column_names(columns))
+
+
+def parse_create_table(statement, dialect):
+    """Translate a CREATE TABLE statement for sqlite.
+
+    Primary keys and other keys declared in the table are taken out of
+    it, so that they can be built as indexes after the rows are loaded.
+
+    Returns:
+      A tuple (table, create_sql, index_sqls).
+
+    """
+    match = _CREATE_TABLE_RE.match(statement)
+    if match is None:
+        raise ValueError('Cannot parse %r.' % statement[:100])
+    table = _table_name(match.group(1))
+    columns = []
+    index_sqls = []
+    for item in _split_top_level(match.group(2)):
+        item = ' '.join(item.replace('`', '').split())
+        key = _KEY_RE.match(item)
+        if key is not None:
+            kind = key.group(1).upper()
+            primary = kind.startswith('PRIMARY')
+            name = 'pk' if primary else (key.group(2) or 'key%d'
+                                         % len(index_sqls))
+            # Index names are global in sqlite, so qualify them.
+            index_sqls.append(_index_sql(
+                '%s_%s' % (table, _table_name(name)), table, key.group(3),
+                primary or kind.startswith('UNIQUE')))
+            continue
+        for regex, replacement in _COLUMN_FIXES[dialect]:
+            item = regex.sub(replacement, item)
+        columns.append(item)
+    create_sql = 'CREATE TABLE %s (%s);' % (table, ', '.join(columns))
+    return table, create_sql, index_sqls
+
+
+def parse_create_index(statement, dialect):
+    """Translate a CREATE INDEX statement for sqlite.
+
+    Returns:
+      A pair (table, index_sql).
+
+    """
+    match = _CREATE_INDEX_RE.match(statement)
+    if match is None:
+        raise ValueError('Cannot parse %r.' % statement[:100])
+    table = _table_name(match.group(3))
+    return table, _index_sql(_table_name(match.group(2)), table,
+                             match.group(4), match.group(1) is not None)
+
+
+def _literal(token):
+    lower = token.lower()
+    if lower == 'null':
+        return None
+    if lower == 'true':
+        return 1
+    if lower == 'false':
+        return 0
+    if _INT_RE.match(token):
+        return int(token)
+    try:
+        return float(token)
+    except ValueError:
+        return token
+
+
+def _unquote_mysql(s):
+    return _MYSQL_STRING_ESCAPE_RE.sub(
+        lambda m: "'" if m.group(1) is None else
+        _MYSQL_ESCAPES.get(m.group(1), m.group(1)), s)
+
+
+def _unquote_mssql(s):
+    return s.replace("''", "'")
+
+
+_UNQUOTE = { MSSQL: _unquote_mssql, MYSQL: _unquote_mysql }
+
+
+def parse_insert(statement, dialect):
+    """Parse the rows out of an INSERT statement.
+
+    A MySQL extended insert may hold many rows.
+
+    Returns:
+      A tuple (table, columns, rows), where columns is the column list
+      of the statement, or None, and rows is a list of tuples.
+
+    """
+    match = _INSERT_RE.match(statement)
+    if match is None:
+        raise ValueError('Cannot parse %r.' % statement[:100])
+    table = _table_name(match.group(1))
+    columns = match.group(2) and _column_names(match.group(2))
+    token_re = _TOKEN_RES[dialect]
+    unquote = _UNQUOTE[dialect]
+    rows = []
+    row = None
+    pos = match.end()
+    while True:
+        token = token_re.match(statement, pos)
+        if token is None:
+            if statement[pos:].strip():
+                raise ValueError('Cannot parse the values at %r.'
+                                 % statement[pos:pos + 100])
+            break
+        pos = token.end()
+        punctuation, string, bare = token.groups()
+        if punctuation == '(':
+            row = []
+        elif punctuation == ')':
+            rows.append(tuple(row))
+            row = None
+        elif punctuation == ';':
+            break
+        elif punctuation == ',':
+            continue
+        elif string is not None:
+            row.append(unquote(string))
+        else:
+            row.append(_literal(bare))
+    return table, columns, rows
+
+
+def _run_task(task):
+    """Parse one task. Runs in a worker process.
+
+    Args:
+      task: A tuple (kind, dialect, payload), where kind is 'table',
+          'index' or 'insert', and payload is a statement or, for
+          'insert', a list of statements.
+
+    Returns:
+      A pair (kind, result). For 'insert', result is a list of (table,
+      columns, rows), with consecutive statements for the same table and
+      columns merged.
+
+    """
+    kind, dialect, payload = task
+    if kind == 'table':
+        return kind, parse_create_table(payload, dialect)
+    if kind == 'index':
+        return kind, parse_create_index(payload, dialect)
+    batches = []
+    for statement in payload:
+        table, columns, rows = parse_insert(statement, dialect)
+        if batches and batches[-1][:2] == (table, columns):
+            batches[-1][2].extend(rows)
+        else:
+            batches.append((table, columns, rows))
+    return kind, batches
+
+
+def _classify(statement):
+    """Return (kind, table) for a statement, or (None, None) to skip it."""
+    match = _INSERT_RE.match(statement)
+    if match is not None:
+        return 'insert', _table_name(match.group(1))
+    match = _CREATE_TABLE_RE.match(statement)
+    if match is not None:
+        return 'table', _table_name(match.group(1))
+    match = _CREATE_INDEX_RE.match(statement)
+    if match is not None:
+        return 'index', _table_name(match.group(3))
+    return None, None
+
+
+def _tasks(statements, dialect, selected):
+    """Group statements into tasks for _run_task, in dump order."""
+    chunk = []
+    size = 0
+    for statement in statements:
+        kind, table = _classify(statement)
+        if kind is None or not selected(table):
+            continue
+        if kind == 'insert':
+            chunk.append(statement)
+            size += len(statement)
+            if size >= _CHUNK_SIZE:
+                yield 'insert', dialect, chunk
+                chunk = []
+                size = 0
+        else:
+            if chunk:
+                yield 'insert', dialect, chunk
+                chunk = []
+                size = 0
+            yield kind, dialect, statement
+    if chunk:
+        yield 'insert', dialect, chunk
+
+
+def _ordered_results(tasks, jobs):
+    """Run tasks in worker processes, yielding the results in order.
+
+    At most a few tasks per worker are outstanding at once, so the dump
+    is never read far ahead of the database writes.
+
+    """
+    if jobs <= 1:
+        for task in tasks:
+            yield _run_task(task)
+        return
+    pool = multiprocessing.Pool(jobs)
+    try:
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(pool.apply_async(_run_task, (task,)))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.close()
+        pool.join()
+
+
+def tune_connection(conn):
+    """Set pragmas that make the import fast, at the cost of safety."""
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA synchronous = OFF;')
+    cursor.execute('PRAGMA journal_mode = OFF;')
+    cursor.execute('PRAGMA temp_store = MEMORY;')
+    cursor.execute('PRAGMA cache_size = -65536;')
+
+
+def _build_index(cursor, sql, out):
+    try:
+        cursor.execute(sql)
+    except sqlite3.IntegrityError, e:
+        # The old scripts loaded duplicate keys without complaint, so
+        # fall back to a plain index rather than fail.
+        print >>out, 'Warning: %s (%s); building a non-unique index.' % (
+            e, sql)
+        cursor.execute(sql.replace('CREATE UNIQUE INDEX', 'CREATE INDEX', 1))
+
+
+def import_dump(conn, lines, dialect, tables=None, jobs=1, out=sys.stdout):
+    """Import a dump into conn.
+
+    Each imported table is dropped and created again. Everything is
+    written in one transaction, and the indexes are built at the end.
+
+    Args:
+      conn: A Connection.
+      lines: An iterable over the lines of the dump, as unicode.
+      dialect: MSSQL or MYSQL.
+      tables: A list of glob patterns of the tables to import, or None
+          for every table. Matching ignores case.
+      jobs: The number of worker processes to parse in.
+      out: Where to write warnings.
+
+    Returns:
+      A pair (stats, index_seconds), where stats is an OrderedDict
+      mapping each table to a pair (rows, seconds), and index_seconds
+      is the time taken building indexes.
+
+    """
+    if tables:
+        patterns = [p.lower() for p in tables]
+        selected = lambda table: any(fnmatch.fnmatchcase(table.lower(), p)
+                                     for p in patterns)
+    else:
+        selected = lambda table: True
+
+    # key = table, value = [rows, seconds]
+    stats = collections.OrderedDict()
+    index_sqls = []
+    insert_sqls = {}
+    cursor = conn.cursor()
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        cursor.execute('BEGIN;')
+        tasks = _tasks(statements(lines, dialect), dialect, selected)
+        mark = time.time()
+        for kind, result in _ordered_results(tasks, jobs):
+            if kind == 'table':
+                table, create_sql, table_indexes = result
+                cursor.execute('DROP TABLE IF EXISTS %s;' % table)
+                cursor.execute(create_sql)
+                index_sqls.extend(table_indexes)
+                stats.setdefault(table, [0, 0.0])
+            elif kind == 'index':
+                index_sqls.append(result[1])
+            else:
+                for table, columns, rows in result:
+                    if not rows:
+                        continue
+                    key = (table, columns, len(rows[0]))
+                    sql = insert_sqls.get(key)
+                    if sql is None:
+                        sql = insert_sqls[key] = (
+                            'INSERT INTO %s%s VALUES (%s);'
+                            % (table, ' (%s)' % columns if columns else '',
+                               ', '.join('?' * len(rows[0]))))
+                    cursor.executemany(sql, rows)
+                    now = time.time()
+                    table_stats = stats.setdefault(table, [0, 0.0])
+                    table_stats[0] += len(rows)
+                    table_stats[1] += now - mark
+                    mark = now
+                continue
+            mark = time.time()
+
+        start = time.time()
+        for sql in index_sqls:
+            _build_index(cursor, sql, out)
+        index_seconds = time.time() - start
+        cursor.execute('COMMIT;')
+    finally:
+        conn.isolation_level = isolation_level
+    return stats, index_seconds
+
+
+def report(stats, index_seconds, out=sys.stdout):
+    total_rows = 0
+    total_seconds = index_seconds
+    for table, (rows, seconds) in stats.iteritems():
+        print >>out, '%-32s %10d rows %8.2fs %10.0f rows/s' % (
+            table, rows, seconds, rows / max(seconds, 1e-9))
+        total_rows += rows
+        total_seconds += seconds
+    print >>out, '%-32s %19.2fs' % ('indexes', index_seconds)
+    print >>out, '%-32s %10d rows %8.2fs %10.0f rows/s' % (
+        'total', total_rows, total_seconds,
+        total_rows / max(total_seconds, 1e-9))
+
+
+def main(argv):
+    flags = read_flags(argv)
+    if flags.sqlfiles:
+        lines = itertools.chain.from_iterable(
+            io.open(filename, 'r', encoding=flags.encoding)
+            for filename in flags.sqlfiles)
+    else:
+        lines = codecs.getreader(flags.encoding)(sys.stdin)
+    lines = iter(lines)
+    if flags.dialect:
+        dialect = flags.dialect
+    else:
+        dialect, lines = probe_dialect(lines)
+    conn = sqlite3.connect(flags.dbfile)
+    try:
+        tune_connection(conn)
+        stats, index_seconds = import_dump(conn, lines, dialect,
+                                           flags.tables, flags.jobs)
+    finally:
+        conn.close()
+    report(stats, index_seconds)
+
+
+if __name__ == '__main__':
+    main(sys.argv)